@@ -0,0 +1,131 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare, salted_hmac
+from rest_framework.authentication import BasicAuthentication
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+User = get_user_model()
+
+CLAIMS = ('username', 'is_staff', 'is_superuser')
+TOKEN_VERSION_CLAIM = 'ver'
+
+
+def token_version_key(user_id):
+    return f'token-version:{user_id}'
+
+
+def revoke_tokens(user_id):
+    """
+    Reject tokens issued to the user until now by moving the user's token version past theirs.
+    The version is kept for JWT_REVOCATION_TTL seconds after the last revocation or token issued with it.
+    """
+    if not settings.JWT_REVOCATION_TTL:
+        return
+    key = token_version_key(user_id)
+    # Versions start at the current time in microseconds, so they keep moving forward when the cache loses
+    # them and tokens issued with an older version stay revoked
+    version = time.time_ns() // 1000
+    if not cache.add(key, version, settings.JWT_REVOCATION_TTL):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Expired since the add
+            cache.add(key, version, settings.JWT_REVOCATION_TTL)
+    cache.touch(key, settings.JWT_REVOCATION_TTL)
+
+
+def is_revoked(user_id, version):
+    """Whether a token of the given version was issued before the user's last revocation (no version is 0)"""
+    if not settings.JWT_REVOCATION_TTL:
+        return False
+    current_version = cache.get(token_version_key(user_id))
+    return current_version is not None and (version or 0) < current_version
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Embed user flags needed by permission checks and the token version into the issued tokens"""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        for claim in CLAIMS:
+            token[claim] = getattr(user, claim)
+        if settings.JWT_REVOCATION_TTL:
+            key = token_version_key(user.pk)
+            version = cache.get(key)
+            if version is not None:
+                token[TOKEN_VERSION_CLAIM] = version
+                # The version has to outlive the tokens carrying it, or a later revocation would start over
+                cache.touch(key, settings.JWT_REVOCATION_TTL)
+        return token
+
+
+class RevocationCheckedTokenRefreshSerializer(TokenRefreshSerializer):
+    """Refuse to refresh tokens of users whose tokens were revoked (see `revoke_tokens`)"""
+
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        if is_revoked(refresh.get(api_settings.USER_ID_CLAIM), refresh.get(TOKEN_VERSION_CLAIM)):
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        return super().validate(attrs)
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that builds the user from token claims instead of loading it from the database.
+
+    Tokens issued without the claims fall back to the database lookup. Tokens of users whose
+    access was changed are rejected through the revocation cache (see `revoke_tokens`).
+    """
+
+    def get_user(self, validated_token):
+        if not all(claim in validated_token for claim in CLAIMS):
+            return super().get_user(validated_token)
+
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            raise InvalidToken('Token contained no recognizable user identification')
+        if is_revoked(user_id, validated_token.get(TOKEN_VERSION_CLAIM)):
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+
+        return TokenUser(validated_token)
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    Basic authentication that remembers verified credentials for BASIC_AUTH_CACHE_TTL seconds.
+
+    Repeated requests skip the password hashing. The cache only holds keyed digests of the
+    credentials and of the stored password hash, so an entry stops matching as soon as the
+    password changes, and inactive users are rejected as usual.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        if not settings.BASIC_AUTH_CACHE_TTL:
+            return super().authenticate_credentials(userid, password, request)
+
+        key = 'basic-auth:' + self.digest(f'{userid}\0{password}')
+        cached = cache.get(key)
+        if cached is not None:
+            user_pk, password_digest = cached
+            user = User._default_manager.filter(pk=user_pk).first()
+            password_unchanged = user is not None and constant_time_compare(password_digest, self.digest(user.password))
+            if password_unchanged and user.is_active:
+                return user, None
+            cache.delete(key)
+
+        user, auth = super().authenticate_credentials(userid, password, request)
+        cache.set(key, (user.pk, self.digest(user.password)), settings.BASIC_AUTH_CACHE_TTL)
+        return user, auth
+
+    @staticmethod
+    def digest(value):
+        return salted_hmac('accounts.authentication.CachedBasicAuthentication', value, algorithm='sha256').hexdigest()
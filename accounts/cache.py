@@ -0,0 +1,89 @@
+"""
+Shared response cache with generation based invalidation.
+
+Every cached resource (e.g. the bank account list or the history of one account) has a
+generation counter stored in the cache. Generations are part of response cache keys, so
+bumping a generation after a write makes all cached responses of the resource unreachable
+on every worker at once and they simply expire afterwards.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+from accounts import metrics
+from accounts.routers import pin_primary
+
+BANK_ACCOUNT_LIST = 'bankaccount-list'
+USER_LIST = 'user-list'
+
+
+def balance_history(bank_account_pk):
+    return f'balance-history:{bank_account_pk}'
+
+
+def generation_key(resource):
+    return f'generation:{resource}'
+
+
+def get_generations(resources):
+    keys = [generation_key(resource) for resource in resources]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            # A time based initial value never repeats a generation that was evicted from the cache
+            cache.add(key, time.time_ns(), None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def bump_generations(*resources):
+    """Invalidate cached responses of the resources once the current transaction commits"""
+    def bump():
+        for resource in resources:
+            key = generation_key(resource)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time.time_ns(), None)
+
+    transaction.on_commit(bump)
+
+
+def cache_response(get_resources, timeout=None):
+    """
+    Cache the data of a view method response for the resources returned by `get_resources(view)`.
+
+    Response data is cached rather than rendered content, so every accepted media type is served
+    from the same entry. Authentication and permission checks still run for cached responses.
+    Responses are built from the primary database, never from a replica.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            resources = get_resources(view)
+            generations = get_generations(resources)
+            versions = '.'.join(f'{resource}@{generation}' for resource, generation in zip(resources, generations))
+            # Scheme and host included, responses hold absolute hyperlinks
+            url_hash = hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+            key = f'response:{versions}:{url_hash}'
+
+            data = cache.get(key)
+            if data is not None:
+                metrics.response_cache.inc(type(view).__name__, 'hit')
+                return Response(data)
+            metrics.response_cache.inc(type(view).__name__, 'miss')
+
+            # A lagging replica would store a page older than the generation it is cached under,
+            # served until the next write
+            pin_primary()
+            response = method(view, request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data, settings.CACHE_TTL if timeout is None else timeout)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,53 @@
+"""
+Filtering, ordering and search of list endpoints, all backed by indexes (see migration 0013):
+
+* bank accounts by `user` (foreign key index), `username` prefix (varchar_pattern_ops index of
+  auth_user.username on PostgreSQL) and `balance_min` / `balance_max` (balance, id index)
+* users by `search` prefix of username or email (varchar_pattern_ops index of auth_user.email)
+"""
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend, OrderingFilter, SearchFilter
+
+
+class BankAccountFilterSerializer(serializers.Serializer):
+    user = serializers.IntegerField(required=False)
+    username = serializers.CharField(required=False, trim_whitespace=False)
+    balance_min = serializers.DecimalField(max_digits=14, decimal_places=2, required=False)
+    balance_max = serializers.DecimalField(max_digits=14, decimal_places=2, required=False)
+
+
+class BankAccountFilter(BaseFilterBackend):
+    """
+    Filter bank accounts by owner id, owner username prefix and balance range. Balances of accounts
+    with balance slots are compared without the slot credits not compacted yet.
+    """
+    lookups = {
+        'user': 'user_id',
+        'username': 'user__username__startswith',
+        'balance_min': 'balance__gte',
+        'balance_max': 'balance__lte',
+    }
+
+    def filter_queryset(self, request, queryset, view):
+        serializer = BankAccountFilterSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        filters = {self.lookups[name]: value for name, value in serializer.validated_data.items()}
+        return queryset.filter(**filters) if filters else queryset
+
+
+class StableOrderingFilter(OrderingFilter):
+    """OrderingFilter breaking ties by primary key, so offset pages do not skip or repeat rows"""
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering and not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering = [*ordering, '-id' if ordering[-1].startswith('-') else 'id']
+        return ordering
+
+
+class PrefixSearchFilter(SearchFilter):
+    """
+    SearchFilter with case sensitive `^` prefix lookups, which (unlike `istartswith`) can use
+    varchar_pattern_ops indexes on PostgreSQL.
+    """
+    lookup_prefixes = {**SearchFilter.lookup_prefixes, '^': 'startswith'}
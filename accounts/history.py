@@ -0,0 +1,246 @@
+"""
+Hot and archived balance history.
+
+Recent balance actions live in BalanceAction, on PostgreSQL a table partitioned by month of
+`performed_at`. `archive_history` moves months older than HISTORY_HOT_MONTHS to BalanceActionArchive
+(whole partitions at once on PostgreSQL, batches of rows elsewhere), so every archived action is
+older than every hot one. History reads go through `TieredQuerySet`, which only queries the archive
+when the requested range reaches past the hot actions.
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connections, router, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from accounts.models import BalanceAction, BalanceActionArchive
+
+PARTITION_PREFIX = f'{BalanceAction._meta.db_table}_p'
+DEFAULT_PARTITION = f'{BalanceAction._meta.db_table}_default'
+# Boundary of a TieredQuerySet not read yet
+UNKNOWN = object()
+
+
+def archived_until():
+    """
+    Return `performed_at` of the newest archived action, None when nothing was archived.
+
+    Read from the database (one lookup of the `performed_at` index) rather than a cache, which may be
+    per process: a boundary cached before `archive_history` ran elsewhere would hide the moved actions.
+    """
+    return BalanceActionArchive.objects.aggregate(newest=Max('performed_at'))['newest']
+
+
+class TieredQuerySet:
+    """
+    Hot balance actions followed by the archived ones (preceded by them in ascending order), read as
+    one queryset. Supports the part of the QuerySet API used by history views and pagination.
+    """
+
+    def __init__(self, hot, archive, since=None, ascending=False, newest_archived=UNKNOWN):
+        self.hot = hot
+        self.archive = archive
+        self.since = since
+        self.ascending = ascending
+        self.newest_archived = newest_archived
+
+    @property
+    def model(self):
+        return self.hot.model
+
+    @property
+    def tiers(self):
+        """Querysets to read in order, without the archive when the range starts after the archived actions"""
+        if self.newest_archived is UNKNOWN:
+            self.newest_archived = archived_until()
+        newest_archived = self.newest_archived
+        if newest_archived is None or (self.since is not None and self.since > newest_archived):
+            return [self.hot]
+        return [self.archive, self.hot] if self.ascending else [self.hot, self.archive]
+
+    def _chain(self, method, *args, **kwargs):
+        return TieredQuerySet(
+            getattr(self.hot, method)(*args, **kwargs),
+            getattr(self.archive, method)(*args, **kwargs),
+            self.since,
+            self.ascending,
+            self.newest_archived
+        )
+
+    def filter(self, *args, **kwargs):
+        clone = self._chain('filter', *args, **kwargs)
+        for lookup in ('performed_at__gt', 'performed_at__gte'):
+            if lookup in kwargs and (clone.since is None or kwargs[lookup] > clone.since):
+                clone.since = kwargs[lookup]
+        return clone
+
+    def order_by(self, *field_names):
+        clone = self._chain('order_by', *field_names)
+        clone.ascending = bool(field_names) and not field_names[0].startswith('-')
+        return clone
+
+    def only(self, *fields):
+        return self._chain('only', *fields)
+
+    def select_related(self, *fields):
+        return self._chain('select_related', *fields)
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.tiers)
+
+    def iterator(self, chunk_size=2000):
+        for queryset in self.tiers:
+            yield from queryset.iterator(chunk_size=chunk_size)
+
+    def __iter__(self):
+        for queryset in self.tiers:
+            yield from queryset
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice) or k.step is not None:
+            raise TypeError('TieredQuerySet only supports slices without a step')
+        start, stop = k.start or 0, k.stop
+        results = []
+        for queryset in self.tiers:
+            rows = list(queryset[start:stop])
+            results.extend(rows)
+            # Positions the next tier starts at
+            consumed = start + len(rows) if rows or not start else queryset.count()
+            start = max(start - consumed, 0)
+            if stop is not None:
+                stop -= consumed
+                if stop <= 0:
+                    break
+        return results
+
+
+def history_queryset(bank_account_pk):
+    """Return hot and archived balance actions of the bank account, newest first"""
+    return TieredQuerySet(
+        BalanceAction.objects.filter(bank_account_id=bank_account_pk),
+        BalanceActionArchive.objects.filter(bank_account_id=bank_account_pk)
+    ).order_by('-performed_at', '-id')
+
+
+def month_start(moment):
+    return moment.astimezone(dt_timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(moment, months):
+    month = moment.month - 1 + months
+    return moment.replace(year=moment.year + month // 12, month=month % 12 + 1)
+
+
+def is_partitioned(connection):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass", [BalanceAction._meta.db_table]
+        )
+        return cursor.fetchone()[0]
+
+
+def get_partitions(connection):
+    """Return {month start: partition name} of the monthly partitions"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = %s::regclass',
+            [BalanceAction._meta.db_table]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    return {
+        datetime.strptime(name[len(PARTITION_PREFIX):], '%Y_%m').replace(tzinfo=dt_timezone.utc): name
+        for name in names if name.startswith(PARTITION_PREFIX)
+    }
+
+
+def create_partitions(connection, months_ahead):
+    """
+    Create the missing monthly partitions up to `months_ahead` months after the current one.
+    Actions of those months already written to the default partition are moved to the new partition.
+    Returns the names of the created partitions.
+    """
+    table = connection.ops.quote_name(BalanceAction._meta.db_table)
+    existing = get_partitions(connection)
+    current = month_start(timezone.now())
+    created = []
+    for start in (add_months(current, months) for months in range(months_ahead + 1)):
+        if start in existing:
+            continue
+        name = f'{PARTITION_PREFIX}{start:%Y_%m}'
+        bounds = [start.isoformat(), add_months(start, 1).isoformat()]
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            # Attaching a partition fails when the default partition holds rows of its range
+            cursor.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)')
+            cursor.execute(
+                f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE performed_at >= %s AND performed_at < %s '
+                f'RETURNING *) INSERT INTO {name} SELECT * FROM moved',
+                bounds
+            )
+            cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', bounds)
+        created.append(name)
+    return created
+
+
+def archive_partitions(connection, before):
+    """Move monthly partitions ending before `before` to the archive and drop them. Returns the moved rows."""
+    table = connection.ops.quote_name(BalanceAction._meta.db_table)
+    archive_table = connection.ops.quote_name(BalanceActionArchive._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in BalanceAction._meta.concrete_fields)
+    moved = 0
+    for start, name in sorted(get_partitions(connection).items()):
+        if add_months(start, 1) > before:
+            break
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            # Copied before detaching, which locks the whole table until the transaction ends
+            cursor.execute(f'INSERT INTO {archive_table} ({columns}) SELECT {columns} FROM {name}')
+            moved += cursor.rowcount
+            cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+            cursor.execute(f'DROP TABLE {name}')
+    return moved
+
+
+def archive_rows(before, batch_size):
+    """Move balance actions performed before `before` to the archive in batches. Returns the moved rows."""
+    fields = [field.attname for field in BalanceAction._meta.concrete_fields]
+    moved = 0
+    while True:
+        with transaction.atomic(using=router.db_for_write(BalanceAction)):
+            pks = list(
+                BalanceAction.objects.filter(performed_at__lt=before).order_by('performed_at', 'id').values_list(
+                    'pk', flat=True
+                )[:batch_size]
+            )
+            if not pks:
+                return moved
+            actions = BalanceAction.objects.filter(pk__in=pks, performed_at__lt=before)
+            BalanceActionArchive.objects.bulk_create(
+                [BalanceActionArchive(**dict(zip(fields, values))) for values in actions.values_list(*fields)]
+            )
+            # The rows are still in history, just stored elsewhere, so no signals (cache invalidation)
+            # are needed and a plain DELETE spares loading every instance
+            actions._raw_delete(actions.db)
+        moved += len(pks)
+
+
+def archive_history(before, batch_size, partitions_ahead=0):
+    """
+    Move balance actions performed before `before` (rounded down to a month start on PostgreSQL)
+    from the hot table to the archive. Returns the number of moved actions.
+    """
+    connection = connections[router.db_for_write(BalanceAction)]
+    partitioned = is_partitioned(connection)
+    if partitioned:
+        before = month_start(before)
+
+    # Actions are moved to the archive in the same transaction they leave the hot table, so history
+    # reads (see `archived_until`) find them in one of the two at any time
+    moved = 0
+    if partitioned:
+        moved += archive_partitions(connection, before)
+        create_partitions(connection, partitions_ahead)
+    # Actions of the default partition or of a table that is not partitioned
+    moved += archive_rows(before, batch_size)
+    return moved
@@ -0,0 +1,38 @@
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from accounts.history import add_months, archive_history, month_start
+
+
+class Command(BaseCommand):
+    help = (
+        'Move balance history older than HISTORY_HOT_MONTHS months to the archive table (whole monthly partitions '
+        'on PostgreSQL, batches of rows otherwise) and create the partitions of the coming months.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-months', type=int, default=settings.HISTORY_HOT_MONTHS,
+            help='Months of history kept in the hot table besides the current one'
+        )
+        parser.add_argument('--before', help='Archive actions performed before this ISO date instead')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows moved per transaction')
+        parser.add_argument(
+            '--partitions-ahead', type=int, default=3, help='Monthly partitions created after the current month'
+        )
+
+    def handle(self, *args, **options):
+        if options['before']:
+            before = parse_datetime(options['before']) or parse_datetime(f'{options["before"]}T00:00:00')
+            if before is None:
+                raise CommandError(f'Invalid date: {options["before"]}')
+            if before.tzinfo is None:
+                before = before.replace(tzinfo=timezone.utc)
+        else:
+            before = add_months(month_start(datetime.now(timezone.utc)), -options['keep_months'])
+
+        moved = archive_history(before, options['batch_size'], options['partitions_ahead'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} balance actions performed before {before.isoformat()}'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import BankAccount
+from accounts.services import backfill_account_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute activity counters of bank accounts (totals, transfer count, last activity) from their history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Bank accounts updated per transaction')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk = 0
+        updated = 0
+        while True:
+            account_pks = list(
+                BankAccount.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not account_pks:
+                break
+            updated += backfill_account_summaries(account_pks)
+            last_pk = account_pks[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} bank accounts'))
@@ -0,0 +1,213 @@
+import json
+import random
+import statistics
+import threading
+import time
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from django.shortcuts import reverse
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from accounts.models import BankAccount, BalanceAction
+
+User = get_user_model()
+
+ENDPOINTS = ('token', 'transfer', 'history', 'account-list')
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed users, bank accounts and history, then drive the API from concurrent clients and report '
+        'throughput, latency percentiles and queries per request for each endpoint.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--accounts-per-user', type=int, default=2)
+        parser.add_argument('--history', type=int, default=50, help='Balance actions seeded per bank account')
+        parser.add_argument('--clients', type=int, default=8, help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per endpoint made by every client')
+        parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+        parser.add_argument('--output', help='Write machine readable results to this JSON file')
+        parser.add_argument('--compare', help='Compare the results with an earlier --output file')
+        parser.add_argument('--keep', action='store_true', help='Do not delete the seeded data')
+
+    def handle(self, *args, **options):
+        prefix = f'bench-{uuid.uuid4().hex[:8]}'
+        password = uuid.uuid4().hex
+
+        started_at = time.perf_counter()
+        staff_user, account_pks = self.seed(prefix, password, options)
+        self.stdout.write(f'Seeded {len(account_pks)} bank accounts in {time.perf_counter() - started_at:.2f}s')
+
+        try:
+            # Measures the endpoints themselves, clients are not rate limited
+            rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}, 'TRANSFER_CONCURRENCY_LIMIT': 0}
+            allowed_hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+            with override_settings(ALLOWED_HOSTS=allowed_hosts, REST_FRAMEWORK=rest_framework):
+                token = Client().post(
+                    reverse('token_obtain_pair'), {'username': staff_user.username, 'password': password}
+                ).data['access']
+                results = {
+                    endpoint: self.run_endpoint(endpoint, token, staff_user.username, password, account_pks, options)
+                    for endpoint in options['endpoints']
+                }
+        finally:
+            if not options['keep']:
+                User.objects.filter(username__startswith=prefix).delete()
+
+        self.report(results)
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                self.compare(json.load(baseline)['results'], results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({
+                    'finished_at': timezone.now().isoformat(),
+                    'database': connection.vendor,
+                    'options': {key: options[key] for key in (
+                        'users', 'accounts_per_user', 'history', 'clients', 'requests'
+                    )},
+                    'results': results,
+                }, output, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    @staticmethod
+    def seed(prefix, password, options):
+        password_hash = make_password(password)
+        users = [
+            User(username=f'{prefix}-{i}', password=password_hash, is_staff=(i == 0))
+            for i in range(max(options['users'], 1))
+        ]
+        User.objects.bulk_create(users, batch_size=1000)
+        user_pks = list(User.objects.filter(username__startswith=prefix).order_by('pk').values_list('pk', flat=True))
+
+        BankAccount.objects.bulk_create([
+            BankAccount(user_id=user_pk, balance=Decimal('100000.00'))
+            for user_pk in user_pks for _ in range(options['accounts_per_user'])
+        ], batch_size=1000)
+        account_pks = list(BankAccount.objects.filter(user_id__in=user_pks).values_list('pk', flat=True))
+
+        actions = []
+        for account_pk in account_pks:
+            for _ in range(options['history']):
+                actions.append(BalanceAction(
+                    bank_account_id=account_pk,
+                    counterparty_account_id=random.choice(account_pks),
+                    direction=random.choice(BalanceAction.Direction.values),
+                    amount=Decimal(random.randint(1, 10000)) / 100
+                ))
+            if len(actions) >= 10000:
+                BalanceAction.objects.bulk_create(actions, batch_size=1000)
+                actions = []
+        BalanceAction.objects.bulk_create(actions, batch_size=1000)
+
+        return User.objects.get(pk=user_pks[0]), account_pks
+
+    def run_endpoint(self, endpoint, token, username, password, account_pks, options):
+        latencies = []
+        query_counts = []
+        status_codes = defaultdict(int)
+        lock = threading.Lock()
+
+        def worker():
+            client = Client(HTTP_AUTHORIZATION=f'Bearer {token}', raise_request_exception=False)
+            thread_latencies, thread_query_counts, thread_status_codes = [], [], defaultdict(int)
+            try:
+                for _ in range(options['requests']):
+                    with CaptureQueriesContext(connection) as queries:
+                        request_started_at = time.perf_counter()
+                        # The test client keeps connections open, unlike the WSGI handler honouring CONN_MAX_AGE
+                        close_old_connections()
+                        response = self.make_request(client, endpoint, username, password, account_pks)
+                        close_old_connections()
+                        thread_latencies.append(time.perf_counter() - request_started_at)
+                    thread_query_counts.append(len(queries))
+                    thread_status_codes[response.status_code] += 1
+            finally:
+                connection.close()
+            with lock:
+                latencies.extend(thread_latencies)
+                query_counts.extend(thread_query_counts)
+                for status_code, count in thread_status_codes.items():
+                    status_codes[status_code] += count
+
+        threads = [threading.Thread(target=worker) for _ in range(options['clients'])]
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started_at
+
+        result = {
+            'requests': len(latencies),
+            'seconds': elapsed,
+            'throughput': len(latencies) / elapsed if elapsed else 0,
+            # Without completed requests (--requests 0, or every request raised) there is nothing to measure
+            'p50_ms': None,
+            'p95_ms': None,
+            'p99_ms': None,
+            'queries_per_request': None,
+            'status_codes': {str(code): count for code, count in sorted(status_codes.items())},
+        }
+        if latencies:
+            percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+            result.update(
+                p50_ms=percentiles[49] * 1000,
+                p95_ms=percentiles[94] * 1000,
+                p99_ms=percentiles[98] * 1000,
+                queries_per_request=statistics.mean(query_counts),
+            )
+        return result
+
+    @staticmethod
+    def make_request(client, endpoint, username, password, account_pks):
+        if endpoint == 'token':
+            return client.post(reverse('token_obtain_pair'), {'username': username, 'password': password})
+        if endpoint == 'transfer':
+            from_account_pk, to_account_pk = random.sample(account_pks, 2)
+            return client.post(
+                reverse('transfer', kwargs={'pk': from_account_pk}), {'amount': '0.01', 'transferee': to_account_pk}
+            )
+        if endpoint == 'history':
+            return client.get(reverse('balance-history', kwargs={'pk': random.choice(account_pks)}))
+        offset = random.randrange(0, len(account_pks), settings.REST_FRAMEWORK['PAGE_SIZE'])
+        return client.get(reverse('bankaccount-list'), {'offset': offset})
+
+    def report(self, results):
+        self.stdout.write(
+            f'{"endpoint":<14}{"requests":>10}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+            f'{"queries":>10}  status codes'
+        )
+        for endpoint, result in results.items():
+            columns = ('throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request')
+            self.stdout.write(
+                f'{endpoint:<14}{result["requests"]:>10}'
+                + ''.join(f'{"-":>10}' if result[key] is None else f'{result[key]:>10.1f}' for key in columns)
+                + f'  {result["status_codes"]}'
+            )
+
+    def compare(self, baseline, results):
+        self.stdout.write('Change against the baseline:')
+        self.stdout.write(f'{"endpoint":<14}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+        for endpoint, result in results.items():
+            if endpoint not in baseline:
+                continue
+            before = baseline[endpoint]
+            changes = [
+                (result[key] - before[key]) / before[key] * 100 if result[key] is not None and before.get(key) else None
+                for key in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms')
+            ]
+            self.stdout.write(f'{endpoint:<14}' + ''.join(
+                f'{"-":>10}' if change is None else f'{change:>+9.1f}%' for change in changes
+            ))
@@ -0,0 +1,111 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from accounts.models import BankAccount, BalanceAction
+from accounts.renderers import ORJSONRenderer, MessagePackRenderer
+from accounts.serializers import BankAccountSerializer, UserSerializer, BalanceActionSerializer
+
+User = get_user_model()
+
+RESOURCES = {
+    'users': (UserSerializer, 'id,username'),
+    'bank-accounts': (BankAccountSerializer, 'id,balance'),
+    'history': (BalanceActionSerializer, 'id,performed_at,amount'),
+}
+RENDERERS = {
+    'json': JSONRenderer,
+    'orjson': ORJSONRenderer,
+    'msgpack': MessagePackRenderer,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the cost of serializing a list page of users, bank accounts and balance history in full, '
+        'compact (`compact=1`) and sparse (`fields=`) modes, then rendering it with every renderer. '
+        'Objects are built in memory, no queries are made.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=200, help='Pages serialized in every mode')
+        parser.add_argument('--resources', nargs='+', choices=RESOURCES, default=list(RESOURCES))
+        parser.add_argument('--renderers', nargs='+', choices=RENDERERS, default=list(RENDERERS))
+
+    def handle(self, *args, **options):
+        objects = self.build_objects(options['page_size'])
+        factory = APIRequestFactory()
+
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for resource in options['resources']:
+                serializer_class, sparse_fields = RESOURCES[resource]
+                modes = (('full', {}), ('compact', {'compact': '1'}), ('fields', {'fields': sparse_fields}))
+                baseline = None
+                for mode, query_params in modes:
+                    request = Request(factory.get('/', query_params))
+                    elapsed = self.measure(serializer_class, objects[resource], request, options['repeat'])
+                    per_page = elapsed / options['repeat'] * 1000
+                    baseline = baseline or per_page
+                    self.stdout.write(
+                        f'{resource:14} {mode:8} {per_page:8.3f} ms/page '
+                        f'{options["page_size"] * options["repeat"] / elapsed:10.0f} rows/s '
+                        f'{baseline / per_page:6.2f}x'
+                    )
+
+                request = Request(factory.get('/'))
+                data = serializer_class(objects[resource], many=True, context={'request': request}).data
+                baseline = None
+                for name in options['renderers']:
+                    renderer = RENDERERS[name]()
+                    started_at = time.perf_counter()
+                    for _ in range(options['repeat']):
+                        content = renderer.render({'results': data})
+                    elapsed = time.perf_counter() - started_at
+                    per_page = elapsed / options['repeat'] * 1000
+                    baseline = baseline or per_page
+                    self.stdout.write(
+                        f'{resource:14} {name:8} {per_page:8.3f} ms/page '
+                        f'{options["page_size"] * options["repeat"] / elapsed:10.0f} rows/s '
+                        f'{baseline / per_page:6.2f}x {len(content):8} bytes'
+                    )
+
+    @staticmethod
+    def measure(serializer_class, page, request, repeat):
+        started_at = time.perf_counter()
+        for _ in range(repeat):
+            serializer_class(page, many=True, context={'request': request}).data
+        return time.perf_counter() - started_at
+
+    @staticmethod
+    def build_objects(page_size):
+        now = timezone.now()
+        users = [
+            User(pk=i, username=f'user-{i}', first_name='First', last_name='Last', email=f'user-{i}@example.com')
+            for i in range(1, page_size + 1)
+        ]
+        bank_accounts = [
+            BankAccount(pk=i, user=user, balance=Decimal('1234.56')) for i, user in enumerate(users, start=1)
+        ]
+        history = [
+            BalanceAction(
+                pk=i,
+                bank_account=bank_accounts[0],
+                performed_at=now - timedelta(minutes=i),
+                amount=Decimal('12.34'),
+                direction=BalanceAction.Direction.DEPOSIT if i % 2 else BalanceAction.Direction.WITHDRAWAL,
+                counterparty_account=bank_accounts[i % page_size],
+                balance_after=Decimal('1234.56')
+            )
+            for i in range(1, page_size + 1)
+        ]
+        return {'users': users, 'bank-accounts': bank_accounts, 'history': history}
@@ -0,0 +1,135 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, DatabaseError
+from rest_framework import exceptions
+
+from accounts.models import BankAccount
+from accounts.services import transfer_money, set_balance_slots, load_slot_balances
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Hammer one hot bank account with concurrent transfers and report throughput and balance drift. '
+        'With several --slots values the benchmark is repeated with that many balance slots of the hot account.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--transfers', type=int, default=200, help='Transfers made by every thread')
+        parser.add_argument('--amount', type=Decimal, default=Decimal('1.00'))
+        parser.add_argument('--keep', action='store_true', help='Do not delete the benchmark accounts')
+        parser.add_argument(
+            '--slots', type=int, nargs='+', default=[0], help='Balance slots of the hot account, one run for each'
+        )
+        parser.add_argument(
+            '--deposits-only', action='store_true', help='Only deposit to the hot account (e.g. a merchant account)'
+        )
+        parser.add_argument(
+            '--round-trip-ms', type=float, default=0,
+            help='Delay added to every query of the workers, emulating the network between application and database'
+        )
+
+    def handle(self, *args, **options):
+        throughputs = {}
+        for slots in options['slots']:
+            self.stdout.write(f'Balance slots:     {slots}')
+            throughputs[slots] = self.run(options, slots)
+            self.stdout.write('')
+
+        if len(throughputs) > 1:
+            baseline = throughputs[options['slots'][0]]
+            for slots, throughput in throughputs.items():
+                self.stdout.write(f'{slots:4} slots {throughput:10.1f} transfers/s {throughput / baseline:6.2f}x')
+
+    def run(self, options, slots):
+        threads_count, transfers_count, amount = options['threads'], options['transfers'], options['amount']
+        deposits_only = options['deposits_only']
+
+        user, _ = User.objects.get_or_create(username='bench-transfers')
+        hot_account = BankAccount.objects.create(user=user, balance=amount * threads_count * transfers_count)
+        peer_balance = amount * transfers_count if deposits_only else 0
+        peer_accounts = [BankAccount.objects.create(user=user, balance=peer_balance) for _ in range(threads_count)]
+        if slots:
+            set_balance_slots(hot_account.pk, slots)
+        account_pks = [hot_account.pk] + [account.pk for account in peer_accounts]
+        initial_total = self.total_balance(account_pks)
+
+        stats = {'completed': 0, 'rejected': 0, 'errors': 0, 'hot_delta': Decimal(0)}
+        lock = threading.Lock()
+
+        def delay(execute, sql, params, many, context):
+            # Row locks are held over these round trips, as they are in production
+            time.sleep(options['round_trip_ms'] / 1000)
+            return execute(sql, params, many, context)
+
+        def worker(peer_pk):
+            completed, rejected, errors, hot_delta = 0, 0, 0, Decimal(0)
+            if options['round_trip_ms']:
+                connection.execute_wrappers.append(delay)
+            try:
+                for i in range(transfers_count):
+                    # Alternate directions so the hot account is both debited and credited
+                    if i % 2 == 0 and not deposits_only:
+                        from_pk, to_pk, delta = hot_account.pk, peer_pk, -amount
+                    else:
+                        from_pk, to_pk, delta = peer_pk, hot_account.pk, amount
+                    try:
+                        transfer_money(from_pk, to_pk, amount)
+                    except exceptions.APIException:
+                        rejected += 1
+                    except DatabaseError:
+                        errors += 1
+                    else:
+                        completed += 1
+                        hot_delta += delta
+            finally:
+                connection.close()
+            with lock:
+                stats['completed'] += completed
+                stats['rejected'] += rejected
+                stats['errors'] += errors
+                stats['hot_delta'] += hot_delta
+
+        workers = [threading.Thread(target=worker, args=(account.pk,)) for account in peer_accounts]
+        started_at = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started_at
+
+        hot_account_balance = self.total_balance([hot_account.pk])
+        hot_account_drift = hot_account.balance + stats['hot_delta'] - hot_account_balance
+        total_drift = initial_total - self.total_balance(account_pks)
+
+        throughput = stats['completed'] / elapsed
+        self.stdout.write(f'Threads:           {threads_count}')
+        self.stdout.write(f'Transfers:         {threads_count * transfers_count} in {elapsed:.2f}s')
+        self.stdout.write(f'Throughput:        {throughput:.1f} transfers/s')
+        self.stdout.write(f'Completed:         {stats["completed"]}')
+        self.stdout.write(f'Rejected:          {stats["rejected"]}')
+        self.stdout.write(f'Database errors:   {stats["errors"]}')
+        self.stdout.write(f'Hot account drift: {hot_account_drift}')
+        self.stdout.write(f'Total drift:       {total_drift}')
+
+        if not options['keep']:
+            BankAccount.objects.filter(pk__in=account_pks).delete()
+
+        if hot_account_drift or total_drift:
+            self.stderr.write(self.style.ERROR('Balance drift detected'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No balance drift'))
+        return throughput
+
+    @staticmethod
+    def total_balance(account_pks):
+        """Sum the balances of the accounts, including the credits held in balance slots"""
+        accounts = list(BankAccount.objects.filter(pk__in=account_pks))
+        load_slot_balances(accounts)
+        return sum(account.total_balance for account in accounts)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import BankAccount
+from accounts.services import compact_balance_slots
+
+
+class Command(BaseCommand):
+    help = 'Fold the balance slots of hot bank accounts back into their account rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, action='append', dest='accounts', help='Only this bank account')
+
+    def handle(self, *args, **options):
+        accounts = BankAccount.objects.filter(balance_slots__gt=0).order_by('pk')
+        if options['accounts']:
+            accounts = accounts.filter(pk__in=options['accounts'])
+
+        compacted = 0
+        for bank_account_pk in accounts.values_list('pk', flat=True).iterator():
+            compact_balance_slots(bank_account_pk)
+            compacted += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Compacted balance slots of {compacted} bank accounts'))
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from accounts.models import BankAccount
+from accounts.services import create_balance_checkpoints
+
+
+class Command(BaseCommand):
+    help = 'Record balance checkpoints for bank account histories that grew since the last run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=1000, help='Balance actions between two checkpoints')
+        parser.add_argument(
+            '--settle-seconds', type=int, default=300,
+            help='Leave balance actions younger than this for the next run'
+        )
+        parser.add_argument('--account', type=int, action='append', dest='accounts', help='Only this bank account')
+
+    def handle(self, *args, **options):
+        accounts = BankAccount.objects.order_by('pk')
+        if options['accounts']:
+            accounts = accounts.filter(pk__in=options['accounts'])
+
+        settle_time = timedelta(seconds=options['settle_seconds'])
+        created = 0
+        for bank_account_pk in accounts.values_list('pk', flat=True).iterator():
+            created += create_balance_checkpoints(bank_account_pk, options['interval'], settle_time)
+
+        self.stdout.write(self.style.SUCCESS(f'Created {created} balance checkpoints'))
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.services import expire_idempotency_keys
+
+
+class Command(BaseCommand):
+    help = 'Delete idempotency keys (and their stored responses) older than IDEMPOTENCY_KEY_TTL, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age', type=int, default=settings.IDEMPOTENCY_KEY_TTL, help='Age in seconds of keys to delete'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = expire_idempotency_keys(timedelta(seconds=options['max_age']), options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} idempotency keys'))
@@ -0,0 +1,246 @@
+import csv
+import io
+import itertools
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.text import capfirst
+
+from accounts import cache
+from accounts.models import BankAccount
+
+User = get_user_model()
+
+
+def hash_password(password):
+    """Hash a raw password and mark an empty one unusable"""
+    return make_password(password or None)
+
+
+def copy_objects(model, objects):
+    """Insert model instances with PostgreSQL COPY, much faster than multi-row INSERT statements"""
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for obj in objects:
+        values = (field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields)
+        writer.writerow(['\\N' if value is None else value for value in values])
+    buffer.seek(0)
+
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) "
+            f"FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        'Import users and their bank accounts from a CSV or NDJSON file. Columns: username, password, email, '
+        'first_name, last_name and balance (a bank account is opened when it is present).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Input file, "-" reads from the standard input')
+        parser.add_argument('--format', choices=('csv', 'ndjson'), help='Defaults to the input file extension')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument(
+            '--hash-workers', type=int, default=0,
+            help='Processes hashing raw passwords, 0 hashes in this process'
+        )
+        parser.add_argument(
+            '--prehashed', action='store_true',
+            help='Passwords are Django password hashes, stored as they are. Rows with other passwords are rejected.'
+        )
+        parser.add_argument('--rejected', help='NDJSON file for rejected rows, defaults to <path>.rejected')
+        parser.add_argument('--no-copy', action='store_true', help='Use INSERT even on PostgreSQL')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        rejected_path = options['rejected'] or ('rejected.ndjson' if path == '-' else f'{path}.rejected')
+        use_copy = connection.vendor == 'postgresql' and not options['no_copy']
+
+        pool = None
+        if options['hash_workers'] and not options['prehashed']:
+            pool = ProcessPoolExecutor(max_workers=options['hash_workers'], initializer=django.setup)
+
+        imported_users, imported_accounts, rejected_count = 0, 0, 0
+        started_at = time.perf_counter()
+        input_file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            with input_file, open(rejected_path, 'w', encoding='utf-8') as rejected_file:
+                rows = self.read_rows(input_file, input_format)
+                while True:
+                    chunk = list(itertools.islice(rows, options['chunk_size']))
+                    if not chunk:
+                        break
+
+                    users, balances, rejected = self.validate_chunk(chunk, options['prehashed'])
+                    for line, row, error in rejected:
+                        if row.get('password'):
+                            row = dict(row, password='<redacted>')
+                        rejected_file.write(json.dumps({'line': line, 'error': error, 'row': row}) + '\n')
+
+                    if not options['prehashed']:
+                        raw_passwords = [user.password for user in users]
+                        if pool:
+                            hashed_passwords = pool.map(hash_password, raw_passwords, chunksize=100)
+                        else:
+                            hashed_passwords = map(hash_password, raw_passwords)
+                        for user, password in zip(users, hashed_passwords):
+                            user.password = password
+
+                    imported_accounts += self.insert_chunk(users, balances, use_copy)
+                    imported_users += len(users)
+                    rejected_count += len(rejected)
+
+                    elapsed = time.perf_counter() - started_at
+                    self.stdout.write(
+                        f'{imported_users} users imported, {rejected_count} rejected '
+                        f'({(imported_users + rejected_count) / elapsed:.0f} rows/s)'
+                    )
+        except OSError as e:
+            raise CommandError(e)
+        finally:
+            if pool:
+                pool.shutdown()
+
+        cache.bump_generations(cache.USER_LIST, cache.BANK_ACCOUNT_LIST)
+
+        elapsed = time.perf_counter() - started_at
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported_users} users and {imported_accounts} bank accounts in {elapsed:.2f}s '
+            f'({(imported_users + rejected_count) / elapsed if elapsed else 0:.0f} rows/s)'
+        ))
+        if rejected_count:
+            self.stdout.write(self.style.WARNING(f'{rejected_count} rows rejected, see {rejected_path}'))
+
+    @staticmethod
+    def read_rows(input_file, input_format):
+        """Yield (line number, row) pairs without reading the whole input into memory"""
+        if input_format == 'csv':
+            reader = csv.DictReader(input_file)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line, text in enumerate(input_file, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError:
+                row = None
+            yield line, row if isinstance(row, dict) else {'_raw': text.rstrip('\n')}
+
+    @staticmethod
+    def validate_chunk(chunk, prehashed=False):
+        """Return users to create, their opening balances and rejected (line, row, error) triples"""
+        username_validator = User.username_validator
+        username_max_length = User._meta.get_field('username').max_length
+        password_max_length = User._meta.get_field('password').max_length
+        # Raw passwords are hashed, so only their type is checked
+        max_lengths = {
+            name: User._meta.get_field(name).max_length for name in ('email', 'first_name', 'last_name')
+        }
+        candidates = {}
+        rejected = []
+
+        for line, row in chunk:
+            try:
+                if '_raw' in row:
+                    raise ValidationError('Not a JSON object')
+                # Values the database would refuse must be rejected here, or they fail the whole chunk
+                for name in ('username', 'password', *max_lengths):
+                    value = row.get(name)
+                    if value in (None, ''):
+                        continue
+                    label = capfirst(User._meta.get_field(name).verbose_name)
+                    if not isinstance(value, str):
+                        raise ValidationError(f'{label} must be a string')
+                    if name in max_lengths and len(value) > max_lengths[name]:
+                        raise ValidationError(f'{label} is longer than {max_lengths[name]} characters')
+                username = (row.get('username') or '').strip()
+                if not username:
+                    raise ValidationError('Username is required')
+                if len(username) > username_max_length:
+                    raise ValidationError(f'Username is longer than {username_max_length} characters')
+                username_validator(username)
+                if username in candidates:
+                    raise ValidationError('Duplicate username in the input')
+                if row.get('email'):
+                    validate_email(row['email'])
+                if prehashed and row.get('password'):
+                    try:
+                        identify_hasher(row['password'])
+                    except ValueError:
+                        raise ValidationError('Password is not a Django password hash')
+                    if len(row['password']) > password_max_length:
+                        raise ValidationError(f'Password is longer than {password_max_length} characters')
+                balance = None
+                if row.get('balance') not in (None, ''):
+                    balance = Decimal(str(row['balance']))
+                    if balance < 0 or balance != balance.quantize(Decimal('0.01')) or balance >= 10 ** 6:
+                        raise ValidationError('Balance must be between 0 and 999999.99 with at most 2 decimal places')
+            except ValidationError as e:
+                rejected.append((line, row, ' '.join(e.messages)))
+                continue
+            except (InvalidOperation, ValueError):
+                rejected.append((line, row, 'Balance is not a number'))
+                continue
+            candidates[username] = (line, row, balance)
+
+        existing = set(User.objects.filter(username__in=candidates).values_list('username', flat=True))
+        users, balances = [], {}
+        now = timezone.now()
+        for username, (line, row, balance) in candidates.items():
+            if username in existing:
+                rejected.append((line, row, 'User with this username already exists'))
+                continue
+            users.append(User(
+                username=username,
+                # Hashed later unless the input is prehashed, empty passwords are unusable
+                password=row.get('password') or (make_password(None) if prehashed else ''),
+                email=row.get('email') or '',
+                first_name=row.get('first_name') or '',
+                last_name=row.get('last_name') or '',
+                date_joined=now
+            ))
+            if balance is not None:
+                balances[username] = balance
+
+        return users, balances, rejected
+
+    @staticmethod
+    def insert_chunk(users, balances, use_copy):
+        """Insert the users and open their bank accounts. Return the number of created bank accounts."""
+        with transaction.atomic():
+            if use_copy:
+                copy_objects(User, users)
+            else:
+                User.objects.bulk_create(users, batch_size=1000)
+
+            # Bulk inserts do not return primary keys on every backend
+            user_pks = dict(User.objects.filter(username__in=balances).values_list('username', 'pk'))
+            accounts = [
+                BankAccount(user_id=user_pks[username], balance=balance) for username, balance in balances.items()
+            ]
+            if use_copy:
+                copy_objects(BankAccount, accounts)
+            else:
+                BankAccount.objects.bulk_create(accounts, batch_size=1000)
+
+        return len(accounts)
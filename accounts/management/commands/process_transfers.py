@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.services import process_pending_transfers
+
+
+class Command(BaseCommand):
+    help = 'Apply transfers queued for asynchronous processing. Several workers can run in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        processed = 0
+        try:
+            while True:
+                batch_processed = process_pending_transfers(options['batch_size'])
+                processed += batch_processed
+                if batch_processed:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} transfers'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import BankAccount
+from accounts.services import set_balance_slots
+
+MAX_BALANCE_SLOTS = 256
+
+
+class Command(BaseCommand):
+    help = (
+        'Split deposits to a hot bank account (e.g. a merchant or fee collection account) across balance slots, '
+        'so concurrent deposits do not wait for the lock of the account row. 0 slots turns it off.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('account', type=int, help='Bank account id')
+        parser.add_argument('slots', type=int, help=f'Number of slots, 0 to {MAX_BALANCE_SLOTS}')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['slots'] <= MAX_BALANCE_SLOTS:
+            raise CommandError(f'Number of slots must be between 0 and {MAX_BALANCE_SLOTS}')
+        try:
+            set_balance_slots(options['account'], options['slots'])
+        except BankAccount.DoesNotExist:
+            raise CommandError(f'Bank account {options["account"]} does not exist')
+
+        self.stdout.write(self.style.SUCCESS(f'Bank account {options["account"]} has {options["slots"]} balance slots'))
@@ -0,0 +1,98 @@
+"""
+In-process request metrics exposed in the Prometheus text format at `/metrics`.
+
+Every gunicorn worker keeps its own registry, so the values are per process (the scraper
+tells processes apart by the instance they were scraped from).
+"""
+import threading
+from collections import defaultdict
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def format_labels(labels):
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return ','.join(f'{name}="{value}"' for name, value in escaped)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self.lock:
+            self.values[labelvalues] += amount
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        for labelvalues, value in values:
+            yield f'{self.name}{{{format_labels(zip(self.labelnames, labelvalues))}}} {value}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self.lock:
+            series = self.values.setdefault(labelvalues, {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def samples(self):
+        with self.lock:
+            values = [(labelvalues, dict(series, buckets=list(series['buckets'])))
+                      for labelvalues, series in self.values.items()]
+        for labelvalues, series in values:
+            labels = list(zip(self.labelnames, labelvalues))
+            for bound, bucket_count in zip(self.buckets, series['buckets']):
+                yield f'{self.name}_bucket{{{format_labels(labels + [("le", bound)])}}} {bucket_count}'
+            yield f'{self.name}_bucket{{{format_labels(labels + [("le", "+Inf")])}}} {series["count"]}'
+            yield f'{self.name}_sum{{{format_labels(labels)}}} {series["sum"]}'
+            yield f'{self.name}_count{{{format_labels(labels)}}} {series["count"]}'
+
+
+request_duration = Histogram(
+    'http_request_duration_seconds', 'Request latency by view', ('view', 'method', 'status'), LATENCY_BUCKETS
+)
+request_queries = Histogram(
+    'http_request_db_queries', 'Database queries made by a request', ('view', 'method'), QUERY_COUNT_BUCKETS
+)
+db_query_duration = Counter(
+    'db_query_duration_seconds_total', 'Time spent in database queries by view', ('view', 'method')
+)
+response_cache = Counter('response_cache_requests_total', 'Response cache lookups by view', ('view', 'result'))
+transfers = Counter('transfers_total', 'Transfers by outcome', ('outcome',))
+throttled_requests = Counter('throttled_requests_total', 'Requests rejected by admission control', ('scope',))
+
+REGISTRY = (request_duration, request_queries, db_query_duration, response_cache, transfers, throttled_requests)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,72 @@
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from accounts import metrics
+from accounts.routers import replica_reads
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def get_view_name(request):
+    """Name the resolved view after its class, and the viewset action if there is one"""
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        return 'unresolved'
+    view_class = getattr(resolver_match.func, 'cls', None)
+    if view_class is None:
+        return resolver_match.view_name
+    action = getattr(resolver_match.func, 'actions', {}).get(request.method.lower())
+    return f'{view_class.__name__}.{action}' if action else view_class.__name__
+
+
+class QueryStats:
+    """Database execute wrapper counting queries and the time spent in them"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started_at
+
+
+class MetricsMiddleware:
+    """Record latency and database usage of every request, labelled by the resolved view"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        query_stats = QueryStats()
+        started_at = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_stats))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started_at
+
+        view_name = get_view_name(request)
+        metrics.request_duration.observe(duration, view_name, request.method, response.status_code)
+        metrics.request_queries.observe(query_stats.count, view_name, request.method)
+        metrics.db_query_duration.inc(view_name, request.method, amount=query_stats.duration)
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """Let safe requests read from the read replicas, see accounts.routers"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method not in SAFE_METHODS:
+            return self.get_response(request)
+        with replica_reads():
+            return self.get_response(request)
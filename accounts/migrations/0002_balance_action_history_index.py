@@ -0,0 +1,17 @@
+# Generated by Django 3.2.4 on 2026-10-18 07:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='balanceaction',
+            index=models.Index(fields=['bank_account', 'performed_at', 'id'], name='balance_action_history_idx'),
+        ),
+    ]
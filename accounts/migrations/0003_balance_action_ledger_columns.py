@@ -0,0 +1,33 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_balance_action_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='balanceaction',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='balanceaction',
+            name='direction',
+            field=models.CharField(choices=[('deposit', 'Deposit'), ('withdrawal', 'Withdrawal')], default='', max_length=10),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='balanceaction',
+            name='counterparty_account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='accounts.bankaccount'),
+        ),
+        migrations.AddField(
+            model_name='balanceaction',
+            name='balance_after',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True),
+        ),
+    ]
@@ -0,0 +1,90 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations
+
+CHUNK_SIZE = 2000
+
+MESSAGE_PATTERN = re.compile(r'^(?P<verb>Withdrawn|Deposited) (?P<amount>\S+) (?:for|by) .*#(?P<counterparty>\d+)$')
+
+
+def iterate_chunks(queryset):
+    """Yield the queryset in primary key ordered chunks without holding all rows in memory"""
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:CHUNK_SIZE])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def parse_messages(apps, schema_editor):
+    """
+    Fill the ledger columns from the messages. Fails, listing the actions, when a message cannot be parsed,
+    as 0005 drops the messages and with them the only record of those actions.
+    """
+    BalanceAction = apps.get_model('accounts', 'BalanceAction')
+    BankAccount = apps.get_model('accounts', 'BankAccount')
+    # The database being migrated, which is not always the one the router picks (e.g. a test replica)
+    db_alias = schema_editor.connection.alias
+    unparsed_pks = []
+
+    for chunk in iterate_chunks(BalanceAction.objects.using(db_alias)):
+        matches = {action.pk: MESSAGE_PATTERN.match(action.message) for action in chunk}
+        counterparty_pks = {int(match.group('counterparty')) for match in matches.values() if match}
+        existing_pks = set(
+            BankAccount.objects.using(db_alias).filter(pk__in=counterparty_pks).values_list('pk', flat=True)
+        )
+
+        for action in chunk:
+            match = matches[action.pk]
+            try:
+                action.amount = Decimal(match.group('amount')) if match else None
+            except InvalidOperation:
+                action.amount = None
+            if action.amount is None or not action.amount.is_finite():
+                unparsed_pks.append(action.pk)
+                continue
+            action.direction = 'deposit' if match.group('verb') == 'Deposited' else 'withdrawal'
+            counterparty_pk = int(match.group('counterparty'))
+            action.counterparty_account_id = counterparty_pk if counterparty_pk in existing_pks else None
+
+        if not unparsed_pks:
+            BalanceAction.objects.using(db_alias).bulk_update(chunk, ['amount', 'direction', 'counterparty_account'])
+
+    if unparsed_pks:
+        listed = ', '.join(str(pk) for pk in unparsed_pks[:100])
+        more = f' and {len(unparsed_pks) - 100} more' if len(unparsed_pks) > 100 else ''
+        raise RuntimeError(
+            f'Cannot parse the message of balance actions {listed}{more}. Correct their messages to '
+            f'"Deposited <amount> by <name>#<account id>" or "Withdrawn <amount> for <name>#<account id>" '
+            f'and migrate again.'
+        )
+
+
+def render_messages(apps, schema_editor):
+    BalanceAction = apps.get_model('accounts', 'BalanceAction')
+    db_alias = schema_editor.connection.alias
+
+    for chunk in iterate_chunks(BalanceAction.objects.using(db_alias).select_related('counterparty_account__user')):
+        for action in chunk:
+            counterparty = action.counterparty_account
+            counterparty_name = f'{counterparty.user.username}#{counterparty.id}' if counterparty else 'closed account'
+            if action.direction == 'deposit':
+                action.message = f'Deposited {action.amount} by {counterparty_name}'
+            else:
+                action.message = f'Withdrawn {action.amount} for {counterparty_name}'
+
+        BalanceAction.objects.using(db_alias).bulk_update(chunk, ['message'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_balance_action_ledger_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(parse_messages, render_messages),
+    ]
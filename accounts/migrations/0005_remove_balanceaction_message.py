@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_backfill_balance_action_ledger_columns'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='balanceaction',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=8),
+        ),
+        # Give the column a default first so the migration can be reversed on populated tables
+        migrations.AlterField(
+            model_name='balanceaction',
+            name='message',
+            field=models.TextField(default=''),
+        ),
+        migrations.RemoveField(
+            model_name='balanceaction',
+            name='message',
+        ),
+    ]
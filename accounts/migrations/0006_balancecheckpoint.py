@@ -0,0 +1,28 @@
+# Generated by Django 3.2.4 on 2026-10-18 07:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_remove_balanceaction_message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('performed_at', models.DateTimeField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('bank_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accounts.bankaccount')),
+                ('last_action', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounts.balanceaction')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='balancecheckpoint',
+            index=models.Index(fields=['bank_account', 'performed_at', 'last_action'], name='balance_checkpoint_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.4 on 2026-10-18 07:18
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_balancecheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingTransfer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('rejected', 'Rejected')], default='pending', max_length=10)),
+                ('result', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('from_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounts.bankaccount')),
+                ('to_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounts.bankaccount')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pendingtransfer',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['id'], name='pending_transfer_queue_idx'),
+        ),
+    ]
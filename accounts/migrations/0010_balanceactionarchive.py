@@ -0,0 +1,35 @@
+# Generated by Django 3.2.4 on 2026-10-18 07:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='balancecheckpoint',
+            name='last_action',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='accounts.balanceaction'),
+        ),
+        migrations.CreateModel(
+            name='BalanceActionArchive',
+            fields=[
+                ('amount', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('direction', models.CharField(choices=[('deposit', 'Deposit'), ('withdrawal', 'Withdrawal')], max_length=10)),
+                ('balance_after', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True)),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('performed_at', models.DateTimeField(db_index=True)),
+                ('bank_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accounts.bankaccount')),
+                ('counterparty_account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='accounts.bankaccount')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='balanceactionarchive',
+            index=models.Index(fields=['bank_account', 'performed_at', 'id'], name='balance_action_archive_idx'),
+        ),
+    ]
@@ -0,0 +1,100 @@
+"""
+Partition the balance action table by month of `performed_at` on PostgreSQL.
+
+The rows are copied into a new partitioned table within the migration transaction, so writes
+to the history wait until it commits. Other backends keep the plain table.
+"""
+from datetime import datetime, timezone
+
+from django.db import migrations
+
+TABLE = 'accounts_balanceaction'
+# Partitions created up front after the current month, later ones are created by `archive_history`
+MONTHS_AHEAD = 3
+
+
+def month_start(moment):
+    return moment.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(moment, months):
+    month = moment.month - 1 + months
+    return moment.replace(year=moment.year + month // 12, month=month % 12 + 1)
+
+
+def create_partitions(cursor, table):
+    """Create monthly partitions from the oldest action to MONTHS_AHEAD months ahead and the default one"""
+    cursor.execute(f'SELECT MIN(performed_at) FROM {TABLE}')
+    oldest = cursor.fetchone()[0]
+    now = datetime.now(timezone.utc)
+    start, end = month_start(oldest or now), add_months(month_start(now), MONTHS_AHEAD + 1)
+    while start < end:
+        cursor.execute(
+            f'CREATE TABLE {TABLE}_p{start:%Y_%m} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)',
+            [start.isoformat(), add_months(start, 1).isoformat()]
+        )
+        start = add_months(start, 1)
+    cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {table} DEFAULT')
+
+
+def rebuild_table(cursor, partitioned):
+    """
+    Copy the table into a new partitioned (or plain) one and swap them. Indexes and foreign keys
+    are recreated from the definitions of the old table, under the names Django gave them.
+    """
+    new_table = f'{TABLE}_new'
+    cursor.execute(
+        'SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s AND indexname <> %s',
+        [TABLE, f'{TABLE}_pkey']
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [TABLE]
+    )
+    foreign_keys = cursor.fetchall()
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+    sequence = cursor.fetchone()[0]
+
+    partition_by = ' PARTITION BY RANGE (performed_at)' if partitioned else ''
+    cursor.execute(f'CREATE TABLE {new_table} (LIKE {TABLE} INCLUDING DEFAULTS){partition_by}')
+    if partitioned:
+        create_partitions(cursor, new_table)
+    cursor.execute(f'INSERT INTO {new_table} SELECT * FROM {TABLE}')
+    # The id sequence would be dropped together with the old table
+    cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {new_table}.id')
+    cursor.execute(f'DROP TABLE {TABLE}')
+    cursor.execute(f'ALTER TABLE {new_table} RENAME TO {TABLE}')
+
+    # A primary key of a partitioned table has to include the partition key
+    primary_key = 'id, performed_at' if partitioned else 'id'
+    cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY ({primary_key})')
+    for index in indexes:
+        cursor.execute(index)
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}')
+
+
+def partition_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        rebuild_table(cursor, partitioned=True)
+
+
+def merge_partitions(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        rebuild_table(cursor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_balanceactionarchive'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_table, merge_partitions),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.4 on 2026-10-18 07:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_partition_balanceaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bankaccount',
+            name='balance_slots',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='BalanceSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('total_deposited', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('transfer_count', models.PositiveIntegerField(default=0)),
+                ('last_activity_at', models.DateTimeField(blank=True, null=True)),
+                ('bank_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accounts.bankaccount')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='balanceslot',
+            constraint=models.UniqueConstraint(fields=('bank_account', 'slot'), name='balance_slot_unique'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.4 on 2026-10-18 08:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+EMAIL_INDEX = 'accounts_user_email_like'
+
+
+def create_email_index(apps, schema_editor):
+    """
+    Index user emails for prefix search. On PostgreSQL LIKE 'prefix%' only uses an index with
+    varchar_pattern_ops, unless the database uses the C collation.
+    """
+    opts = apps.get_model(settings.AUTH_USER_MODEL)._meta
+    table, column = schema_editor.quote_name(opts.db_table), schema_editor.quote_name(opts.get_field('email').column)
+    opclass = ' varchar_pattern_ops' if schema_editor.connection.vendor == 'postgresql' else ''
+    schema_editor.execute(f'CREATE INDEX {EMAIL_INDEX} ON {table} ({column}{opclass})')
+
+
+def drop_email_index(apps, schema_editor):
+    schema_editor.execute(f'DROP INDEX {EMAIL_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        # The last migration altering auth_user, which may rebuild the table without this index on SQLite
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('accounts', '0012_balance_slots'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bankaccount',
+            index=models.Index(fields=['balance', 'id'], name='bank_account_balance_idx'),
+        ),
+        # Usernames are already indexed for prefix search by Django (auth_user_username_..._like)
+        migrations.RunPython(create_email_index, drop_email_index),
+    ]
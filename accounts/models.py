@@ -1,3 +1,4 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth import get_user_model
 
@@ -9,9 +10,149 @@ class BankAccount(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     balance = models.DecimalField(max_digits=8, decimal_places=2)
 
+    # Activity counters, maintained by transfers (see `backfill_account_summaries` for older history)
+    total_deposited = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_withdrawn = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    transfer_count = models.PositiveIntegerField(default=0)
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+
+    # With N > 0 slots, deposits credit one of N BalanceSlot rows instead of this row (see BalanceSlot)
+    balance_slots = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Balance range filters and ordering by balance (see accounts.filters)
+            models.Index(fields=['balance', 'id'], name='bank_account_balance_idx'),
+        ]
+
+    @property
+    def total_balance(self):
+        """Balance including the credits held in balance slots, loaded by `services.load_slot_balances`"""
+        return self.balance + getattr(self, 'slot_balance', 0)
+
+
+class BalanceSlot(models.Model):
+    """
+    Store a share of the balance of a hot bank account. Deposits to the account credit a random slot,
+    so concurrent deposits do not wait for each other on the account row lock. `compact_balance_slots`
+    folds the slots back into the account row.
+    """
+    bank_account = models.ForeignKey(BankAccount, on_delete=models.CASCADE)
+    slot = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    total_deposited = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    transfer_count = models.PositiveIntegerField(default=0)
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bank_account', 'slot'], name='balance_slot_unique'),
+        ]
+
+
+class AbstractBalanceAction(models.Model):
+    """Fields of a balance action, shared by the hot history table and its archive"""
+
+    class Direction(models.TextChoices):
+        DEPOSIT = 'deposit', 'Deposit'
+        WITHDRAWAL = 'withdrawal', 'Withdrawal'
 
-class BalanceAction(models.Model):
-    """Store a single balance action entry of bank account history"""
     bank_account = models.ForeignKey(BankAccount, on_delete=models.CASCADE)
     performed_at = models.DateTimeField(auto_now_add=True, editable=False)
-    message = models.TextField()
+    amount = models.DecimalField(max_digits=8, decimal_places=2)
+    direction = models.CharField(max_length=10, choices=Direction.choices)
+    counterparty_account = models.ForeignKey(
+        BankAccount, null=True, blank=True, on_delete=models.SET_NULL, related_name='+'
+    )
+    balance_after = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def message(self):
+        """Render a human readable description of the action"""
+        counterparty = self.counterparty_account
+        counterparty_name = f'{counterparty.user.username}#{counterparty.id}' if counterparty else 'closed account'
+        if self.direction == self.Direction.DEPOSIT:
+            return f'Deposited {self.amount} by {counterparty_name}'
+        return f'Withdrawn {self.amount} for {counterparty_name}'
+
+
+class BalanceAction(AbstractBalanceAction):
+    """
+    Store a single balance action entry of bank account history.
+
+    On PostgreSQL the table is partitioned by month of `performed_at` (its primary key is
+    (id, performed_at)), old months are moved to BalanceActionArchive by `archive_history`.
+    """
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bank_account', 'performed_at', 'id'], name='balance_action_history_idx'),
+        ]
+
+
+class BalanceActionArchive(AbstractBalanceAction):
+    """Store a balance action moved out of the hot history table, keeping its original id"""
+    id = models.BigIntegerField(primary_key=True)
+    performed_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bank_account', 'performed_at', 'id'], name='balance_action_archive_idx'),
+        ]
+
+
+class BalanceCheckpoint(models.Model):
+    """Store a snapshot of bank account balance right after one of its balance actions"""
+    bank_account = models.ForeignKey(BankAccount, on_delete=models.CASCADE)
+    # No database constraint, the action may be archived (and partitioned tables cannot be referenced by id alone)
+    last_action = models.ForeignKey(
+        BalanceAction, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+'
+    )
+    performed_at = models.DateTimeField()
+    balance = models.DecimalField(max_digits=8, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bank_account', 'performed_at', 'last_action'], name='balance_checkpoint_idx'),
+        ]
+
+
+class PendingTransfer(models.Model):
+    """Store a transfer accepted for asynchronous processing by the `process_transfers` worker"""
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        COMPLETED = 'completed', 'Completed'
+        REJECTED = 'rejected', 'Rejected'
+
+    from_account = models.ForeignKey(BankAccount, on_delete=models.CASCADE, related_name='+')
+    to_account = models.ForeignKey(BankAccount, on_delete=models.CASCADE, related_name='+')
+    amount = models.DecimalField(max_digits=8, decimal_places=2)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(status='pending'), name='pending_transfer_queue_idx'),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """Store the response of a request made with an `Idempotency-Key` header, replayed for retries"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    # Hash of the request parameters, a key cannot be reused for a different request
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_unique'),
+        ]
@@ -0,0 +1,123 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.utils.urls import replace_query_param
+
+COUNT_EXACT = 'exact'
+COUNT_NONE = 'none'
+COUNT_ESTIMATE = 'estimate'
+COUNT_CACHED = 'cached'
+
+# Below this many rows planner estimates are too rough and an exact count is cheap anyway
+ESTIMATE_THRESHOLD = 10000
+
+
+def count_cache_key(queryset):
+    # Selected columns (e.g. sparse fieldsets) do not change the count
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    return 'pagination-count:' + hashlib.md5(repr((sql, params)).encode('utf-8')).hexdigest()
+
+
+def refresh_count(queryset, key):
+    """Count the rows in a background thread and store the result for `get_cached_count`"""
+    try:
+        cache.set(key, (queryset.count(), time.time()), None)
+    finally:
+        connections[queryset.db].close()
+
+
+def get_cached_count(queryset):
+    """
+    Return an exact count computed at most PAGINATION_COUNT_CACHE_TTL seconds ago. Only the first
+    request waits for the count, later ones get the cached value while a stale one is refreshed.
+    """
+    key = count_cache_key(queryset)
+    cached = cache.get(key)
+    if cached is None:
+        count = queryset.count()
+        cache.set(key, (count, time.time()), None)
+        return count
+
+    count, counted_at = cached
+    stale = time.time() - counted_at > settings.PAGINATION_COUNT_CACHE_TTL
+    # Only one worker refreshes a stale count
+    if stale and cache.add(f'{key}:refresh', True, settings.PAGINATION_COUNT_CACHE_TTL):
+        threading.Thread(target=refresh_count, args=(queryset._chain(), key), daemon=True).start()
+    return count
+
+
+def get_estimated_count(queryset):
+    """Return the PostgreSQL planner estimate of an unfiltered table, otherwise an exact count"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or queryset.query.where:
+        return queryset.count()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    # -1 or 0 when the table has not been analyzed yet
+    if row is None or row[0] < ESTIMATE_THRESHOLD:
+        return queryset.count()
+    return row[0]
+
+
+class CountModePagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination with the `count` computed according to PAGINATION_COUNT_MODES of the view:
+
+    * exact - COUNT(*) on every page
+    * none - no count, one extra row is fetched to tell whether there is a next page
+    * estimate - planner estimate from pg_class.reltuples for unfiltered lists on PostgreSQL
+    * cached - exact count cached for PAGINATION_COUNT_CACHE_TTL seconds and refreshed in the background
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_mode = settings.PAGINATION_COUNT_MODES.get(type(view).__name__, COUNT_EXACT)
+        if self.count_mode == COUNT_EXACT:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        self.request = request
+
+        if self.count_mode == COUNT_ESTIMATE:
+            self.count = get_estimated_count(queryset)
+        elif self.count_mode == COUNT_CACHED:
+            self.count = get_cached_count(queryset)
+        else:
+            self.count = None
+
+        # Approximate counts cannot tell where the list ends
+        results = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(results) > self.limit
+        return results[:self.limit]
+
+    def get_next_link(self):
+        if self.count_mode == COUNT_EXACT:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+
+class BalanceHistoryCursorPagination(CursorPagination):
+    """
+    Keyset pagination of balance history, newest entries first.
+
+    Pages are fetched by seeking the (bank_account, performed_at, id) index instead
+    of scanning past an OFFSET, so deep pages cost the same as the first one.
+    """
+    ordering = ('-performed_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -0,0 +1,45 @@
+"""
+Read replica routing.
+
+Reads made while handling a safe request (see ReplicaRoutingMiddleware) go to one of
+DATABASE_REPLICAS. Once anything is written, or code calls `pin_primary` (e.g. transfers,
+which must see their own writes), the rest of the request reads from the primary as well.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+replica_reads_allowed = ContextVar('replica_reads_allowed', default=False)
+
+
+@contextmanager
+def replica_reads():
+    """Allow reads from replicas within the block, until something is written"""
+    token = replica_reads_allowed.set(True)
+    try:
+        yield
+    finally:
+        replica_reads_allowed.reset(token)
+
+
+def pin_primary():
+    """Read from the primary for the rest of the current replica_reads block"""
+    replica_reads_allowed.set(False)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if settings.DATABASE_REPLICAS and replica_reads_allowed.get():
+            return random.choice(settings.DATABASE_REPLICAS)
+        return None
+
+    def db_for_write(self, model, **hints):
+        pin_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
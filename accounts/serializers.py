@@ -1,13 +1,125 @@
+from decimal import Decimal
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import connection, models, transaction
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
-from accounts.models import BankAccount, BalanceAction
+from accounts import cache
+from accounts.models import BankAccount, BalanceAction, PendingTransfer
+from accounts.services import load_slot_balances
 
 User = get_user_model()
 
+# Fields of bank accounts that include the balance slots not compacted yet
+SLOT_FIELDS = {'balance', 'total_deposited', 'transfer_count', 'last_activity_at'}
+
+
+def get_requested_fields(request):
+    """Return the field names listed in the `fields` query parameter, None when it is not given"""
+    fields = request.query_params.get('fields')
+    if not fields:
+        return None
+    return {name.strip() for name in fields.split(',') if name.strip()}
+
+
+def is_compact_request(request):
+    return request.query_params.get('compact') in ('1', 'true')
+
+
+def is_sparse_request(request):
+    return request.method in ('GET', 'HEAD') and (
+        get_requested_fields(request) is not None or is_compact_request(request)
+    )
+
+
+class SparseFieldsetMixin:
+    """
+    Serialize only the fields listed in the `fields` query parameter of a GET request.
+    With `compact=1` hyperlinks are left out, sparing a reverse() call for every row.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or not is_sparse_request(request):
+            return
+        requested = get_requested_fields(request)
+        compact = is_compact_request(request)
+        for name, field in list(self.fields.items()):
+            if requested is not None and name not in requested:
+                self.fields.pop(name)
+            elif compact and isinstance(field, serializers.HyperlinkedIdentityField):
+                self.fields.pop(name)
+
+
+class PrefetchedUserRelatedField(serializers.PrimaryKeyRelatedField):
+    """Take users from the ones prefetched into the serializer context, instead of one query per value"""
+
+    def to_internal_value(self, data):
+        prefetched_users = self.context.get('prefetched_users')
+        if prefetched_users is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            user = prefetched_users.get(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if user is None:
+            self.fail('does_not_exist', pk_value=data)
+        return user
+
+
+class BankAccountListSerializer(serializers.ListSerializer):
+    """Validate all referenced users with a single query and create the bank accounts in one transaction"""
+
+    def __init__(self, *args, **kwargs):
+        # Like the transfers of a batch transfer, a bulk create needs at least one item
+        kwargs.setdefault('allow_empty', False)
+        super().__init__(*args, **kwargs)
+
+    def to_representation(self, data):
+        data = list(data.all() if isinstance(data, models.Manager) else data)
+        if self.child.fields.keys() & SLOT_FIELDS:
+            # One query for the balance slots of the whole page
+            load_slot_balances(data)
+        return super().to_representation(data)
+
+    def to_internal_value(self, data):
+        # Before any item is validated, so oversized payloads do not cost a lookup of all their users
+        if isinstance(data, list) and len(data) > settings.BULK_CREATE_MAX_SIZE:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    f'Ensure there are no more than {settings.BULK_CREATE_MAX_SIZE} items.'
+                ]
+            }, code='max_length')
+        if isinstance(data, list):
+            user_pks = set()
+            for item in data:
+                try:
+                    user_pks.add(int(item['user']))
+                except (TypeError, ValueError, KeyError):
+                    pass
+            self.context['prefetched_users'] = User.objects.in_bulk(user_pks)
+        return super().to_internal_value(data)
+
+    def create(self, validated_data):
+        bank_accounts = [BankAccount(**item) for item in validated_data]
+        with transaction.atomic():
+            if connection.features.can_return_rows_from_bulk_insert:
+                BankAccount.objects.bulk_create(bank_accounts)
+                cache.bump_generations(cache.BANK_ACCOUNT_LIST)
+            else:
+                # Primary keys of the created rows are needed for the response
+                for bank_account in bank_accounts:
+                    bank_account.save()
+        return bank_accounts
+
 
-class BankAccountSerializer(serializers.ModelSerializer):
-    user = serializers.PrimaryKeyRelatedField(
+class BankAccountSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    user = PrefetchedUserRelatedField(
         queryset=User.objects.all(),
         many=False
     )
@@ -15,11 +127,52 @@ class BankAccountSerializer(serializers.ModelSerializer):
     class Meta:
         model = BankAccount
         fields = ('url', 'id', 'user', 'balance')
+        list_serializer_class = BankAccountListSerializer
 
         read_only_fields = ('id',)
+        sparse_columns = {'balance': ('balance', 'balance_slots')}
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if 'balance' in data and instance.balance_slots:
+            # Credits held in the balance slots are part of the balance
+            load_slot_balances([instance])
+            data['balance'] = self.fields['balance'].to_representation(instance.total_balance)
+        return data
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
+
+class BankAccountSummarySerializer(BankAccountSerializer):
+    class Meta(BankAccountSerializer.Meta):
+        fields = BankAccountSerializer.Meta.fields + (
+            'total_deposited', 'total_withdrawn', 'transfer_count', 'last_activity_at'
+        )
+        read_only_fields = fields
+        sparse_columns = {
+            **BankAccountSerializer.Meta.sparse_columns,
+            'total_deposited': ('total_deposited', 'balance_slots'),
+            'transfer_count': ('transfer_count', 'balance_slots'),
+            'last_activity_at': ('last_activity_at', 'balance_slots'),
+        }
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if not instance.balance_slots or not data.keys() & SLOT_FIELDS:
+            return data
+        # Deposits credited to the balance slots count until they are compacted into the account row
+        load_slot_balances([instance])
+        if 'total_deposited' in data:
+            data['total_deposited'] = self.fields['total_deposited'].to_representation(
+                instance.total_deposited + instance.slot_total_deposited
+            )
+        if 'transfer_count' in data:
+            data['transfer_count'] = instance.transfer_count + instance.slot_transfer_count
+        if 'last_activity_at' in data:
+            moments = [moment for moment in (instance.last_activity_at, instance.slot_last_activity_at) if moment]
+            data['last_activity_at'] = self.fields['last_activity_at'].to_representation(max(moments, default=None))
+        return data
+
+
+class UserSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = User
         fields = ('url', 'username', 'id', 'password', 'is_staff', 'first_name', 'last_name', 'email')
@@ -52,15 +205,55 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
         return user
 
 
-class BalanceActionSerializer(serializers.ModelSerializer):
+class BalanceActionSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    message = serializers.CharField(read_only=True)
+
     class Meta:
         model = BalanceAction
         fields = '__all__'
+        # Columns `message` is rendered from, for fields not backed by a model field of the same name
+        sparse_columns = {
+            'message': ('direction', 'amount', 'counterparty_account', 'counterparty_account__user__username')
+        }
 
 
 class TransferSerializer(serializers.Serializer):
-    transferee = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.all(),
-        many=False
-    )
-    amount = serializers.DecimalField(max_digits=8, decimal_places=2)
+    transferee = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=Decimal('0.01'))
+
+
+class PendingTransferSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PendingTransfer
+        fields = ('id', 'from_account', 'to_account', 'amount', 'status', 'result', 'created_at', 'processed_at')
+
+
+class BatchTransferItemSerializer(serializers.Serializer):
+    transferer = serializers.IntegerField()
+    transferee = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=Decimal('0.01'))
+
+
+class BatchTransferSerializer(serializers.Serializer):
+    transfers = BatchTransferItemSerializer(many=True, allow_empty=False)
+
+    def to_internal_value(self, data):
+        # Before any item is validated, so oversized batches are rejected cheaply
+        transfers = data.get('transfers') if isinstance(data, dict) else None
+        if isinstance(transfers, list) and len(transfers) > settings.BATCH_TRANSFER_MAX_SIZE:
+            raise serializers.ValidationError({
+                'transfers': [f'Ensure this field has no more than {settings.BATCH_TRANSFER_MAX_SIZE} elements.']
+            }, code='max_length')
+        return super().to_internal_value(data)
+
+
+class BalanceAtSerializer(serializers.Serializer):
+    t = serializers.DateTimeField()
+    bank_account = serializers.IntegerField(read_only=True)
+    balance = serializers.DecimalField(max_digits=8, decimal_places=2, read_only=True)
+
+
+class BalanceHistoryExportSerializer(serializers.Serializer):
+    output = serializers.ChoiceField(choices=('csv', 'ndjson'), default='csv')
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
@@ -1,41 +1,521 @@
+import random
+from datetime import timedelta
 from decimal import Decimal
-from django.db import transaction
-from rest_framework import status, exceptions
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q, Sum, Case, When, Count, Max, DecimalField, Subquery, Value
+from django.db.models.functions import Mod, NullIf
+from django.utils import timezone
+from rest_framework import status, exceptions, serializers
 
+from accounts import cache
+from accounts.history import history_queryset, archived_until
+from accounts.routers import pin_primary
 from accounts.models import (
     BankAccount,
-    BalanceAction
+    BalanceAction,
+    BalanceActionArchive,
+    BalanceCheckpoint,
+    BalanceSlot,
+    PendingTransfer,
+    IdempotencyKey
 )
 
+BULK_BATCH_SIZE = 500
+# Slots are picked as a random number in this range modulo the number of slots
+SLOT_PICK_RANGE = 2 ** 16
+# Amounts of a single transfer, also accepted by the amount fields of the transfer serializers
+AMOUNT_FIELD = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=Decimal('0.01'))
 
-def add_balance_action(bank_account, message):
-    BalanceAction.objects.create(bank_account=bank_account, message=message)
 
+def load_slot_balances(accounts, lock=False):
+    """
+    Set `slot_balance` of the accounts with balance slots (so that `total_balance` includes it), with
+    one query for all of them. With `lock` the slots are locked against concurrent deposits.
 
-def update_account_balance(account, add_amount):
-    account.balance = account.balance + add_amount
-    account.save()
-    return account.balance
+    The activity counters of the slots not compacted yet are set too, as `slot_total_deposited`,
+    `slot_transfer_count` and `slot_last_activity_at`.
+    """
+    slotted = {account.pk: account for account in accounts if account.balance_slots and (
+        lock or not hasattr(account, 'slot_balance')
+    )}
+    if not slotted:
+        return
+    for account in slotted.values():
+        account.slot_balance = Decimal(0)
+        account.slot_total_deposited = Decimal(0)
+        account.slot_transfer_count = 0
+        account.slot_last_activity_at = None
+    slots = BalanceSlot.objects.filter(bank_account__in=slotted).only(
+        'bank_account', 'balance', 'total_deposited', 'transfer_count', 'last_activity_at'
+    )
+    if lock:
+        slots = slots.select_for_update().order_by('bank_account', 'slot')
+    for slot in slots:
+        account = slotted[slot.bank_account_id]
+        account.slot_balance += slot.balance
+        account.slot_total_deposited += slot.total_deposited
+        account.slot_transfer_count += slot.transfer_count
+        if slot.last_activity_at and (
+            account.slot_last_activity_at is None or slot.last_activity_at > account.slot_last_activity_at
+        ):
+            account.slot_last_activity_at = slot.last_activity_at
+
+
+def withdraw_from_account(account_pk, amount, performed_at):
+    """
+    Debit the account with a single guarded UPDATE. Return False if there is not enough money.
+
+    When the account row alone does not hold enough, the account is locked and the credits held
+    in its balance slots are counted too.
+    """
+    changes = {
+        'balance': F('balance') - amount,
+        'total_withdrawn': F('total_withdrawn') + amount,
+        'transfer_count': F('transfer_count') + 1,
+        'last_activity_at': performed_at
+    }
+    if BankAccount.objects.filter(pk=account_pk, balance__gte=amount).update(**changes) == 1:
+        return True
+
+    # Slot balances only grow until compaction, which locks the account row first
+    account = BankAccount.objects.select_for_update().filter(pk=account_pk, balance_slots__gt=0).first()
+    if account is None:
+        return False
+    load_slot_balances([account])
+    if account.total_balance < amount:
+        return False
+    # The account row may go below zero, its slots cover the difference
+    return BankAccount.objects.filter(pk=account_pk).update(**changes) == 1
+
+
+def deposit_to_account(account_pk, amount, performed_at):
+    """
+    Credit the account with a single UPDATE. Return False if the account does not exist.
+
+    Accounts with balance slots are not updated (nor locked), a random slot of theirs is credited instead.
+    """
+    changes = {
+        'balance': F('balance') + amount,
+        'total_deposited': F('total_deposited') + amount,
+        'transfer_count': F('transfer_count') + 1,
+        'last_activity_at': performed_at
+    }
+    if BankAccount.objects.filter(pk=account_pk, balance_slots=0).update(**changes) == 1:
+        return True
+
+    # A random slot, picked in the same statement as the number of slots is read
+    balance_slots = BankAccount.objects.filter(pk=account_pk).values('balance_slots')
+    slot = Mod(Value(random.randrange(SLOT_PICK_RANGE)), NullIf(Subquery(balance_slots), Value(0)))
+    if BalanceSlot.objects.filter(bank_account_id=account_pk, slot=slot).update(**changes) == 1:
+        return True
+    # The slots were turned off meanwhile (or the account does not exist)
+    return BankAccount.objects.filter(pk=account_pk).update(**changes) == 1
+
+
+def compact_balance_slots(bank_account_pk):
+    """Fold the balance slots of the account back into the account row. Return the moved balance."""
+    with transaction.atomic():
+        account = BankAccount.objects.select_for_update().get(pk=bank_account_pk)
+        slots = list(BalanceSlot.objects.select_for_update().filter(bank_account_id=bank_account_pk).order_by('slot'))
+        if not any(slot.balance or slot.transfer_count for slot in slots):
+            return Decimal(0)
+
+        moved = sum((slot.balance for slot in slots), Decimal(0))
+        account.balance += moved
+        account.total_deposited += sum(slot.total_deposited for slot in slots)
+        account.transfer_count += sum(slot.transfer_count for slot in slots)
+        account.last_activity_at = max(
+            (moment for moment in [account.last_activity_at] + [slot.last_activity_at for slot in slots] if moment),
+            default=None
+        )
+        account.save(update_fields=['balance', 'total_deposited', 'transfer_count', 'last_activity_at'])
+        BalanceSlot.objects.filter(bank_account_id=bank_account_pk).update(
+            balance=0, total_deposited=0, transfer_count=0, last_activity_at=None
+        )
+    return moved
+
+
+def set_balance_slots(bank_account_pk, count):
+    """Split deposits to the account across `count` balance slots, 0 turns the slots off"""
+    with transaction.atomic():
+        compact_balance_slots(bank_account_pk)
+        BalanceSlot.objects.filter(bank_account_id=bank_account_pk, slot__gte=count).delete()
+        existing = set(BalanceSlot.objects.filter(bank_account_id=bank_account_pk).values_list('slot', flat=True))
+        BalanceSlot.objects.bulk_create([
+            BalanceSlot(bank_account_id=bank_account_pk, slot=slot) for slot in range(count) if slot not in existing
+        ])
+        BankAccount.objects.filter(pk=bank_account_pk).update(balance_slots=count)
+
+
+def withdrawal_action(from_account, to_account, amount):
+    return BalanceAction(
+        bank_account=from_account,
+        direction=BalanceAction.Direction.WITHDRAWAL,
+        amount=amount,
+        counterparty_account=to_account,
+        balance_after=from_account.total_balance
+    )
+
+
+def deposit_action(to_account, from_account, amount):
+    return BalanceAction(
+        bank_account=to_account,
+        direction=BalanceAction.Direction.DEPOSIT,
+        amount=amount,
+        counterparty_account=from_account,
+        balance_after=to_account.total_balance
+    )
+
+
+def parse_amount(amount):
+    """
+    Return a transfer amount as a Decimal, raise ValidationError for anything but a positive amount
+    of whole cents. Guarded balance updates only check for enough money, not for the sign.
+    """
+    try:
+        # Through str, so amounts parsed from JSON numbers keep their decimal value instead of the float's
+        return AMOUNT_FIELD.run_validation(str(amount))
+    except exceptions.ValidationError as e:
+        raise exceptions.ValidationError({'amount': e.detail})
 
 
 def transfer_money(from_account_pk, to_account_pk, amount):
     if from_account_pk == to_account_pk:
         raise exceptions.PermissionDenied(detail='You cannot transfer money between the same bank account')
 
-    from_account = BankAccount.objects.select_related('user').get(pk=from_account_pk)
-    to_account = BankAccount.objects.select_related('user').get(pk=to_account_pk)
+    amount = parse_amount(amount)
+    performed_at = timezone.now()
+    # Balances read back after the updates must not come from a lagging replica
+    pin_primary()
+
+    with transaction.atomic():
+        # Balances are changed in the database itself, so there is no read-modify-write window.
+        # Rows are updated in primary key order so opposite transfers cannot deadlock.
+        for account_pk in sorted((from_account_pk, to_account_pk)):
+            if account_pk == from_account_pk and not withdraw_from_account(from_account_pk, amount, performed_at):
+                if not BankAccount.objects.filter(pk=from_account_pk).exists():
+                    raise exceptions.NotFound(detail='Bank account does not exist')
+                raise exceptions.PermissionDenied(detail='Not enough money available')
+            if account_pk == to_account_pk and not deposit_to_account(to_account_pk, amount, performed_at):
+                raise exceptions.NotFound(detail='Bank account does not exist')
+
+        accounts = BankAccount.objects.in_bulk([from_account_pk, to_account_pk])
+        from_account, to_account = accounts[from_account_pk], accounts[to_account_pk]
+        # Balances of accounts with slots may already include concurrent deposits to other slots
+        load_slot_balances(accounts.values())
+
+        BalanceAction.objects.bulk_create([
+            withdrawal_action(from_account, to_account, amount),
+            deposit_action(to_account, from_account, amount),
+        ])
+        cache.bump_generations(
+            cache.BANK_ACCOUNT_LIST,
+            cache.balance_history(from_account_pk),
+            cache.balance_history(to_account_pk)
+        )
+
+    return {'New transferer balance': from_account.total_balance, 'New transferee balance': to_account.total_balance}
+
+
+def transfer_money_batch(transfers):
+    """
+    Apply a list of transfers in a single transaction.
+
+    Every item is a dict with `from_account`, `to_account` and `amount` keys. All involved
+    bank accounts are loaded and locked with one query, in primary key order, so concurrent
+    batches cannot deadlock each other. Items are applied in the given order and rejected
+    items do not affect the rest of the batch. Returns a result for each item.
+    """
+    account_pks = {pk for item in transfers for pk in (item['from_account'], item['to_account'])}
+    results = []
+    actions = []
+    changed_accounts = {}
+    performed_at = timezone.now()
+
+    with transaction.atomic():
+        accounts = {
+            account.pk: account
+            for account in BankAccount.objects.select_for_update().filter(pk__in=account_pks).order_by('pk')
+        }
+        # Deposits to accounts with slots are applied to the account rows here, the slots only count
+        # towards the available balance
+        load_slot_balances(accounts.values(), lock=True)
+
+        for item in transfers:
+            from_account = accounts.get(item['from_account'])
+            to_account = accounts.get(item['to_account'])
+            amount = Decimal(item['amount'])
+
+            if from_account is None or to_account is None:
+                results.append({'status': 'rejected', 'detail': 'Bank account does not exist'})
+                continue
+            if from_account.pk == to_account.pk:
+                results.append({
+                    'status': 'rejected',
+                    'detail': 'You cannot transfer money between the same bank account'
+                })
+                continue
+            # Items of BatchTransferSerializer are validated already, pending transfers may predate validation
+            if amount <= 0 or amount != amount.quantize(Decimal('0.01')):
+                results.append({'status': 'rejected', 'detail': 'Amount has to be a positive number of cents'})
+                continue
+            if amount > from_account.total_balance:
+                results.append({'status': 'rejected', 'detail': 'Not enough money available'})
+                continue
+
+            from_account.balance -= amount
+            from_account.total_withdrawn += amount
+            to_account.balance += amount
+            to_account.total_deposited += amount
+            for account in (from_account, to_account):
+                account.transfer_count += 1
+                account.last_activity_at = performed_at
+            changed_accounts[from_account.pk] = from_account
+            changed_accounts[to_account.pk] = to_account
+
+            actions.append(withdrawal_action(from_account, to_account, amount))
+            actions.append(deposit_action(to_account, from_account, amount))
+            results.append({
+                'status': 'completed',
+                'New transferer balance': from_account.total_balance,
+                'New transferee balance': to_account.total_balance
+            })
+
+        BankAccount.objects.bulk_update(
+            changed_accounts.values(),
+            ['balance', 'total_deposited', 'total_withdrawn', 'transfer_count', 'last_activity_at'],
+            batch_size=BULK_BATCH_SIZE
+        )
+        BalanceAction.objects.bulk_create(actions, batch_size=BULK_BATCH_SIZE)
+        if changed_accounts:
+            cache.bump_generations(
+                cache.BANK_ACCOUNT_LIST,
+                *[cache.balance_history(account_pk) for account_pk in changed_accounts]
+            )
+
+    return results
+
+
+def enqueue_transfer(from_account_pk, to_account_pk, amount):
+    """Validate a transfer and store it for asynchronous processing by `process_pending_transfers`"""
+    if from_account_pk == to_account_pk:
+        raise exceptions.PermissionDenied(detail='You cannot transfer money between the same bank account')
+    amount = parse_amount(amount)
+    if BankAccount.objects.filter(pk__in=(from_account_pk, to_account_pk)).count() != 2:
+        raise exceptions.NotFound(detail='Bank account does not exist')
+
+    return PendingTransfer.objects.create(from_account_id=from_account_pk, to_account_id=to_account_pk, amount=amount)
+
+
+def run_idempotent(user_pk, key, fingerprint, action):
+    """
+    Run `action`, returning response data and status code, once for the idempotency key of a user.
 
-    amount = Decimal(amount)
+    The key is stored in the same transaction as the effects of the action, so a retry either
+    finds it together with the original response or runs the action itself. Returns
+    (data, status code, whether the response is replayed).
+    """
+    stored = IdempotencyKey.objects.filter(user_id=user_pk, key=key).first()
+    if stored is None:
+        try:
+            with transaction.atomic():
+                data, status_code = action()
+                IdempotencyKey.objects.create(
+                    user_id=user_pk, key=key, fingerprint=fingerprint, status_code=status_code, response=data
+                )
+            return data, status_code, False
+        except IntegrityError:
+            # A concurrent request with the same key committed first, its effects were rolled back
+            stored = IdempotencyKey.objects.filter(user_id=user_pk, key=key).first()
+            if stored is None:
+                raise
 
-    available_balance = from_account.balance
-    if amount > available_balance:
-        raise exceptions.PermissionDenied(detail='Not enough money available')
+    if stored.fingerprint != fingerprint:
+        raise exceptions.ValidationError({'Idempotency-Key': 'This key was already used for a different request'})
+    return stored.response, stored.status_code, True
 
+
+def expire_idempotency_keys(max_age, batch_size):
+    """Delete idempotency keys older than `max_age` in batches of short transactions. Return the number deleted."""
+    cutoff = timezone.now() - max_age
+    deleted = 0
+    while True:
+        pks = list(IdempotencyKey.objects.filter(created_at__lt=cutoff).values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=pks).delete()[0]
+
+
+def process_pending_transfers(batch_size):
+    """
+    Claim a batch of pending transfers and apply them with `transfer_money_batch`.
+
+    Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several workers can drain
+    the queue in parallel without picking the same transfers. Returns the number of
+    processed transfers.
+    """
     with transaction.atomic():
-        new_from_balance = update_account_balance(from_account, -amount)
-        new_to_balance = update_account_balance(to_account, amount)
+        claimed = list(
+            PendingTransfer.objects.select_for_update(skip_locked=True).filter(
+                status=PendingTransfer.Status.PENDING
+            ).order_by('id')[:batch_size]
+        )
+        if not claimed:
+            return 0
+
+        results = transfer_money_batch([
+            {'from_account': pending.from_account_id, 'to_account': pending.to_account_id, 'amount': pending.amount}
+            for pending in claimed
+        ])
+
+        processed_at = timezone.now()
+        for pending, result in zip(claimed, results):
+            pending.status = result['status']
+            pending.result = result
+            pending.processed_at = processed_at
+        PendingTransfer.objects.bulk_update(claimed, ['status', 'result', 'processed_at'], batch_size=BULK_BATCH_SIZE)
+
+    return len(claimed)
+
+
+def signed_amount_sum(actions):
+    """Sum the amounts of hot and archived balance actions in SQL, counting withdrawals as negative"""
+    signed_amount = Case(
+        When(direction=BalanceAction.Direction.DEPOSIT, then=F('amount')),
+        default=-F('amount'),
+        output_field=DecimalField(max_digits=8, decimal_places=2)
+    )
+    return sum(
+        (queryset.aggregate(total=Sum(signed_amount))['total'] or Decimal(0) for queryset in actions.tiers),
+        Decimal(0)
+    )
 
-        add_balance_action(from_account, f'Withdrawn {amount} for {to_account.user.username}#{to_account.id}')
-        add_balance_action(to_account, f'Deposited {amount} by {from_account.user.username}#{from_account.id}')
 
-    return {'New transferer balance': new_from_balance, 'New transferee balance': new_to_balance}
+def actions_after(actions, performed_at, action_pk):
+    """Filter balance actions that come after the given (performed_at, id) position"""
+    return actions.filter(
+        Q(performed_at__gt=performed_at) | Q(performed_at=performed_at, pk__gt=action_pk),
+        # Redundant, but tells the history which storage tiers to read
+        performed_at__gte=performed_at
+    )
+
+
+def actions_until(actions, performed_at, action_pk):
+    """Filter balance actions up to and including the given (performed_at, id) position"""
+    return actions.filter(Q(performed_at__lt=performed_at) | Q(performed_at=performed_at, pk__lte=action_pk))
+
+
+def create_balance_checkpoints(bank_account_pk, interval, settle_time=timedelta(minutes=5)):
+    """
+    Record a balance checkpoint after every `interval` balance actions of the bank account.
+
+    Continues from the latest existing checkpoint, so only new actions are read. Actions younger
+    than `settle_time` are left for the next run, as transactions still in flight may insert
+    actions with an earlier `performed_at`. Returns the number of created checkpoints.
+    """
+    actions = history_queryset(bank_account_pk).filter(performed_at__lt=timezone.now() - settle_time)
+    last_checkpoint = BalanceCheckpoint.objects.filter(
+        bank_account_id=bank_account_pk
+    ).order_by('-performed_at', '-last_action_id').first()
+
+    if last_checkpoint:
+        balance = last_checkpoint.balance
+        actions = actions_after(actions, last_checkpoint.performed_at, last_checkpoint.last_action_id)
+    else:
+        # The opening balance is whatever the current balance was before all of the history.
+        # The account row is locked so no transfer can slip in between both reads.
+        with transaction.atomic():
+            account = BankAccount.objects.select_for_update().get(pk=bank_account_pk)
+            load_slot_balances([account], lock=True)
+            balance = account.total_balance - signed_amount_sum(history_queryset(bank_account_pk))
+
+    checkpoints = []
+    actions = actions.order_by('performed_at', 'id').only('id', 'performed_at', 'amount', 'direction')
+    for position, action in enumerate(actions.iterator(chunk_size=interval), start=1):
+        if action.direction == BalanceAction.Direction.DEPOSIT:
+            balance += action.amount
+        else:
+            balance -= action.amount
+        if position % interval == 0:
+            checkpoints.append(BalanceCheckpoint(
+                bank_account_id=bank_account_pk,
+                last_action_id=action.pk,
+                performed_at=action.performed_at,
+                balance=balance
+            ))
+
+    BalanceCheckpoint.objects.bulk_create(checkpoints, batch_size=BULK_BATCH_SIZE)
+    return len(checkpoints)
+
+
+def get_balance_at(bank_account_pk, moment):
+    """
+    Return the balance of the bank account as of the given moment.
+
+    Starts from the nearest checkpoint and replays only the balance actions between
+    the checkpoint and the moment, so the cost does not depend on the history length.
+    """
+    actions = history_queryset(bank_account_pk)
+    checkpoints = BalanceCheckpoint.objects.filter(bank_account_id=bank_account_pk)
+
+    previous_checkpoint = checkpoints.filter(
+        performed_at__lte=moment
+    ).order_by('-performed_at', '-last_action_id').first()
+    if previous_checkpoint:
+        replayed = actions_after(actions, previous_checkpoint.performed_at, previous_checkpoint.last_action_id)
+        return previous_checkpoint.balance + signed_amount_sum(replayed.filter(performed_at__lte=moment))
+
+    # Before the first checkpoint the history is replayed backwards from the checkpoint
+    next_checkpoint = checkpoints.order_by('performed_at', 'last_action_id').first()
+    if next_checkpoint:
+        replayed = actions_until(actions, next_checkpoint.performed_at, next_checkpoint.last_action_id)
+        return next_checkpoint.balance - signed_amount_sum(replayed.filter(performed_at__gt=moment))
+
+    try:
+        account = BankAccount.objects.get(pk=bank_account_pk)
+    except BankAccount.DoesNotExist:
+        raise exceptions.NotFound(detail='Bank account does not exist')
+    load_slot_balances([account])
+    return account.total_balance - signed_amount_sum(actions.filter(performed_at__gt=moment))
+
+
+def backfill_account_summaries(bank_account_pks):
+    """Recompute activity counters of the bank accounts from their balance history"""
+    with transaction.atomic():
+        # Locked, so that transfers made meanwhile are not overwritten
+        accounts = list(BankAccount.objects.select_for_update().filter(pk__in=bank_account_pks))
+        # Deposits counted in the slots are part of the recomputed counters, the slots keep only their balance
+        slots = BalanceSlot.objects.select_for_update().filter(bank_account__in=bank_account_pks).order_by('pk')
+        BalanceSlot.objects.filter(pk__in=[slot.pk for slot in slots]).update(
+            total_deposited=0, transfer_count=0, last_activity_at=None
+        )
+        summaries = {}
+        models = [BalanceAction] if archived_until() is None else [BalanceAction, BalanceActionArchive]
+        for model in models:
+            for summary in model.objects.filter(bank_account__in=bank_account_pks).values('bank_account').annotate(
+                total_deposited=Sum('amount', filter=Q(direction=BalanceAction.Direction.DEPOSIT)),
+                total_withdrawn=Sum('amount', filter=Q(direction=BalanceAction.Direction.WITHDRAWAL)),
+                transfer_count=Count('id'),
+                last_activity_at=Max('performed_at')
+            ).order_by():
+                # Archived actions are older, the hot ones hold the last activity
+                totals = summaries.setdefault(summary['bank_account'], {
+                    'total_deposited': 0, 'total_withdrawn': 0, 'transfer_count': 0,
+                    'last_activity_at': summary['last_activity_at']
+                })
+                totals['total_deposited'] += summary['total_deposited'] or 0
+                totals['total_withdrawn'] += summary['total_withdrawn'] or 0
+                totals['transfer_count'] += summary['transfer_count']
+        for account in accounts:
+            summary = summaries.get(account.pk, {})
+            account.total_deposited = summary.get('total_deposited', 0)
+            account.total_withdrawn = summary.get('total_withdrawn', 0)
+            account.transfer_count = summary.get('transfer_count', 0)
+            account.last_activity_at = summary.get('last_activity_at')
+        BankAccount.objects.bulk_update(
+            accounts,
+            ['total_deposited', 'total_withdrawn', 'transfer_count', 'last_activity_at'],
+            batch_size=BULK_BATCH_SIZE
+        )
+        cache.bump_generations(cache.BANK_ACCOUNT_LIST)
+    return len(accounts)
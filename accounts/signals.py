@@ -0,0 +1,49 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import is_password_usable
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from accounts import cache
+from accounts.authentication import revoke_tokens
+from accounts.models import BankAccount, BalanceAction
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=BankAccount)
+def invalidate_bank_accounts(sender, instance, **kwargs):
+    cache.bump_generations(cache.BANK_ACCOUNT_LIST)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_users(sender, instance, **kwargs):
+    cache.bump_generations(cache.USER_LIST)
+
+
+@receiver([post_save, post_delete], sender=BalanceAction)
+def invalidate_balance_history(sender, instance, **kwargs):
+    cache.bump_generations(cache.balance_history(instance.bank_account_id))
+
+
+@receiver(pre_save, sender=User)
+def revoke_changed_user_tokens(sender, instance, update_fields=None, **kwargs):
+    """Token claims become stale when the password or the access flags of the user change"""
+    if instance._state.adding or update_fields == frozenset(['last_login']):
+        return
+    fields = ['is_active', 'is_staff', 'is_superuser']
+    stored = User.objects.filter(pk=instance.pk).values('password', *fields).first()
+    if stored and is_password_usable(stored['password']):
+        # No token can have been obtained with an empty or unusable password, like the one of a user
+        # saved again by UserSerializer.create after set_password
+        fields.append('password')
+    if stored and any(stored[field] != getattr(instance, field) for field in fields):
+        user_id = instance.pk
+        transaction.on_commit(lambda: revoke_tokens(user_id))
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    """Token claims of a deleted user would otherwise keep authenticating requests"""
+    user_id = instance.pk
+    transaction.on_commit(lambda: revoke_tokens(user_id))
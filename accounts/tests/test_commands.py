@@ -0,0 +1,151 @@
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+
+from accounts.models import BankAccount
+
+User = get_user_model()
+
+
+class TestImportAccounts(TestCase):
+    fixtures = ['user-data.json']
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_input(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as input_file:
+            input_file.write(content)
+        return path
+
+    def read_rejected(self, path):
+        with open(f'{path}.rejected', encoding='utf-8') as rejected_file:
+            return [json.loads(line) for line in rejected_file]
+
+    def test_import_csv(self):
+        path = self.write_input('customers.csv', (
+            'username,password,email,first_name,last_name,balance\n'
+            'newcustomer1,secret-password,first@example.com,First,Customer,10.50\n'
+            'newcustomer2,,,,,\n'
+            'newcustomer3,,not-an-email,,,\n'
+            'admin,,,,,\n'
+            'newcustomer1,,,,,1\n'
+        ))
+
+        call_command('import_accounts', path, chunk_size=2, stdout=StringIO())
+
+        customer = User.objects.get(username='newcustomer1')
+        self.assertTrue(customer.check_password('secret-password'))
+        self.assertEqual(customer.email, 'first@example.com')
+        self.assertEqual(list(customer.bankaccount_set.values_list('balance', flat=True)), [Decimal('10.50')])
+        customer = User.objects.get(username='newcustomer2')
+        self.assertFalse(customer.has_usable_password())
+        self.assertFalse(customer.bankaccount_set.exists())
+        self.assertFalse(User.objects.filter(username='newcustomer3').exists())
+
+        rejected = self.read_rejected(path)
+        self.assertEqual([row['line'] for row in rejected], [4, 5, 6])
+
+    def test_import_hashes_passwords_looking_like_hashes(self):
+        password = make_password('secret-password')
+        path = self.write_input('customers.ndjson', json.dumps({'username': 'newcustomer1', 'password': password}))
+
+        call_command('import_accounts', path, stdout=StringIO())
+
+        customer = User.objects.get(username='newcustomer1')
+        self.assertNotEqual(customer.password, password)
+        self.assertTrue(customer.check_password(password))
+
+    def test_import_prehashed_passwords(self):
+        password = make_password('secret-password')
+        path = self.write_input('customers.ndjson', '\n'.join([
+            json.dumps({'username': 'newcustomer1', 'password': password}),
+            json.dumps({'username': 'newcustomer2', 'password': 'secret-password'}),
+            json.dumps({'username': 'newcustomer3'}),
+        ]))
+
+        call_command('import_accounts', path, prehashed=True, stdout=StringIO())
+
+        self.assertTrue(User.objects.get(username='newcustomer1').check_password('secret-password'))
+        self.assertFalse(User.objects.filter(username='newcustomer2').exists())
+        self.assertFalse(User.objects.get(username='newcustomer3').has_usable_password())
+        self.assertEqual([row['line'] for row in self.read_rejected(path)], [2])
+
+    def test_import_rejects_values_not_fitting_columns(self):
+        path = self.write_input('customers.ndjson', '\n'.join([
+            json.dumps({'username': 'newcustomer1', 'last_name': 'x' * 151}),
+            json.dumps({'username': 'newcustomer2', 'first_name': ['First']}),
+            json.dumps({'username': 'newcustomer3', 'last_name': 'x' * 150}),
+        ]))
+
+        call_command('import_accounts', path, stdout=StringIO())
+
+        self.assertEqual(list(User.objects.filter(username__startswith='newcustomer').values_list(
+            'username', flat=True
+        )), ['newcustomer3'])
+        self.assertEqual([(row['line'], row['error']) for row in self.read_rejected(path)], [
+            (1, 'Last name is longer than 150 characters'), (2, 'First name must be a string')
+        ])
+
+    def test_import_ndjson(self):
+        path = self.write_input('customers.ndjson', '\n'.join([
+            json.dumps({'username': 'newcustomer1', 'balance': 5}),
+            json.dumps({'username': 'newcustomer2', 'balance': '-1'}),
+            'not json',
+        ]))
+
+        call_command('import_accounts', path, stdout=StringIO())
+
+        self.assertEqual(BankAccount.objects.get(user__username='newcustomer1').balance, 5)
+        self.assertFalse(User.objects.filter(username='newcustomer2').exists())
+        self.assertEqual([row['line'] for row in self.read_rejected(path)], [2, 3])
+
+
+class TestBench(TransactionTestCase):
+    """The benchmark clients run in threads with their own connections, which only see committed rows"""
+
+    def test_bench_without_requests(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = os.path.join(directory.name, 'bench.json')
+        stdout = StringIO()
+
+        call_command(
+            'bench', users=2, history=1, clients=2, requests=0, endpoints=['history'], output=output, stdout=stdout
+        )
+
+        with open(output, encoding='utf-8') as output_file:
+            result = json.load(output_file)['results']['history']
+        self.assertEqual(result['requests'], 0)
+        self.assertEqual(result['throughput'], 0)
+        self.assertIsNone(result['p50_ms'])
+        self.assertIsNone(result['queries_per_request'])
+        self.assertIn('history', stdout.getvalue())
+
+    def test_bench_with_requests(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = os.path.join(directory.name, 'bench.json')
+
+        call_command(
+            'bench', users=2, history=1, clients=1, requests=3, endpoints=['account-list'], output=output,
+            stdout=StringIO()
+        )
+
+        with open(output, encoding='utf-8') as output_file:
+            result = json.load(output_file)['results']['account-list']
+        self.assertEqual(result['requests'], 3)
+        self.assertEqual(result['status_codes'], {'200': 3})
+        self.assertGreater(result['throughput'], 0)
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request'):
+            self.assertIsNotNone(result[key])
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
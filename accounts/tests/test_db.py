@@ -0,0 +1,201 @@
+import threading
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.shortcuts import reverse
+from django.test import SimpleTestCase, TestCase, override_settings
+from psycopg2 import ProgrammingError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from accounts.models import BankAccount
+from accounts.routers import ReplicaRouter, replica_reads, pin_primary
+from accounts.services import transfer_money
+from fininstitution.db.pool import ConnectionPool, PoolTimeout
+
+User = get_user_model()
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql):
+        if self.connection.broken:
+            raise ConnectionError('server closed the connection')
+        if not self.connection.autocommit:
+            self.connection.transaction_status = TRANSACTION_STATUS_INTRANS
+
+
+class FakeConnection:
+    """Like a new psycopg2 connection: not in autocommit mode, so queries open a transaction"""
+
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.transaction_status = TRANSACTION_STATUS_IDLE
+        self._autocommit = False
+
+    @property
+    def autocommit(self):
+        return self._autocommit
+
+    @autocommit.setter
+    def autocommit(self, value):
+        if self.transaction_status != TRANSACTION_STATUS_IDLE:
+            raise ProgrammingError('set_session cannot be used inside a transaction')
+        self._autocommit = value
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.transaction_status
+
+    def rollback(self):
+        self.transaction_status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class TestConnectionPool(SimpleTestCase):
+    def test_returned_connections_reused(self):
+        pool = ConnectionPool(size=2, timeout=1)
+        connection = pool.get(FakeConnection)
+        connection.transaction_status = TRANSACTION_STATUS_INTRANS
+        pool.put(connection)
+
+        self.assertIs(pool.get(FakeConnection), connection)
+        self.assertEqual(connection.transaction_status, TRANSACTION_STATUS_IDLE)
+
+    def test_broken_connections_replaced(self):
+        pool = ConnectionPool(size=1, timeout=1, health_checks=True)
+        connection = pool.get(FakeConnection)
+        pool.put(connection)
+        connection.broken = True
+
+        new_connection = pool.get(FakeConnection)
+
+        self.assertIsNot(new_connection, connection)
+        self.assertTrue(connection.closed)
+
+    def test_waits_for_connection_up_to_timeout(self):
+        pool = ConnectionPool(size=1, timeout=0.05)
+        pool.get(FakeConnection)
+        with self.assertRaises(PoolTimeout):
+            pool.get(FakeConnection)
+
+        pool = ConnectionPool(size=1, timeout=5)
+        connection = pool.get(FakeConnection)
+        threading.Timer(0.05, pool.put, args=(connection,)).start()
+        self.assertIs(pool.get(FakeConnection), connection)
+
+    def test_fill_opens_idle_connections(self):
+        pool = ConnectionPool(size=2, timeout=1)
+        pool.fill(5, FakeConnection)
+
+        self.assertEqual(len(pool.idle), 2)
+        filled = list(pool.idle)
+        self.assertCountEqual([pool.get(FakeConnection) for _ in range(2)], filled)
+
+    def test_filled_connections_checked_outside_transaction(self):
+        pool = ConnectionPool(size=1, timeout=1, health_checks=True)
+        pool.fill(1, FakeConnection)
+
+        connection = pool.get(FakeConnection)
+
+        self.assertEqual(connection.transaction_status, TRANSACTION_STATUS_IDLE)
+        # What Django does with every new connection
+        connection.autocommit = True
+
+    def test_returned_connections_left_in_autocommit(self):
+        pool = ConnectionPool(size=1, timeout=1, health_checks=True)
+        connection = pool.get(FakeConnection)
+        connection.cursor().execute('SELECT 1')
+        pool.put(connection)
+
+        self.assertIs(pool.get(FakeConnection), connection)
+        self.assertTrue(connection.autocommit)
+        self.assertEqual(connection.transaction_status, TRANSACTION_STATUS_IDLE)
+
+    def test_close_closes_idle_connections(self):
+        pool = ConnectionPool(size=2, timeout=1)
+        borrowed = pool.get(FakeConnection)
+        pool.fill(1, FakeConnection)
+        idle = pool.idle[0]
+        pool.close()
+
+        self.assertTrue(idle.closed)
+        self.assertFalse(borrowed.closed)
+        self.assertEqual(len(pool.idle), 0)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class TestReplicaRouter(TestCase):
+    databases = {'default', 'replica'}
+    fixtures = ['user-data.json']
+
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.get(username='staffuser'))
+
+    def test_reads_go_to_replica_until_write(self):
+        self.assertIsNone(self.router.db_for_read(BankAccount))
+
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(BankAccount), 'replica')
+            self.assertEqual(self.router.db_for_write(BankAccount), 'default')
+            self.assertIsNone(self.router.db_for_read(BankAccount))
+
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(BankAccount), 'replica')
+            pin_primary()
+            self.assertIsNone(self.router.db_for_read(BankAccount))
+
+    def test_safe_requests_read_from_replica(self):
+        bank_account = BankAccount.objects.using('replica').create(
+            user=User.objects.using('replica').first(), balance=7
+        )
+
+        response = self.client.get(reverse('bankaccount-detail', kwargs={'pk': bank_account.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['balance'], '7.00')
+
+    def test_cached_responses_built_from_primary(self):
+        # The replica has not caught up with the primary yet
+        BankAccount.objects.using('replica').create(user=User.objects.using('replica').first(), balance=7)
+        BankAccount.objects.create(user=User.objects.first(), balance=10)
+
+        for _ in range(2):
+            response = self.client.get(reverse('bankaccount-list'))
+            self.assertEqual([account['balance'] for account in response.data['results']], ['10.00'])
+
+    def test_transfers_use_primary(self):
+        bank_account1 = BankAccount.objects.create(user=User.objects.first(), balance=50)
+        bank_account2 = BankAccount.objects.create(user=User.objects.last(), balance=0)
+
+        response = self.client.post(
+            reverse('transfer', kwargs={'pk': bank_account1.pk}), {'amount': 5, 'transferee': bank_account2.pk}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with replica_reads():
+            content = transfer_money(bank_account2.pk, bank_account1.pk, 1)
+        self.assertEqual(content['New transferee balance'], 46)
+        self.assertFalse(BankAccount.objects.using('replica').exists())
+
+    def test_reads_outside_request_transaction(self):
+        for view in (reverse('bankaccount-list'), reverse('balance-history', kwargs={'pk': 1})):
+            callback = self.client.get(view).resolver_match.func
+            self.assertIn('default', getattr(callback, '_non_atomic_requests', set()))
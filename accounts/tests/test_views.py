@@ -1,13 +1,37 @@
 import base64
-
+import csv
+import json
+from unittest import mock
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+import msgpack
+from django.conf import settings
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password
 from django.shortcuts import reverse
 from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
 from rest_framework.test import APIClient
-from rest_framework import status
-
-from accounts.models import BankAccount
+from rest_framework import exceptions, status
+
+from accounts.history import archive_rows
+from accounts.models import BankAccount, BalanceAction, BalanceCheckpoint, IdempotencyKey, PendingTransfer
+from accounts.serializers import BankAccountSerializer, BatchTransferItemSerializer
+from accounts.services import transfer_money, transfer_money_batch, enqueue_transfer
+from accounts.throttling import (
+    TRANSFERS_IN_FLIGHT_KEY,
+    TRANSFERS_IN_FLIGHT_TIMEOUT,
+    TokenBucketThrottle,
+    acquire_transfer_slot,
+    release_transfer_slot
+)
 
 User = get_user_model()
 
@@ -16,6 +40,7 @@ class TestBankAPIViews(TestCase):
     fixtures = ['user-data.json']
 
     def setUp(self):
+        cache.clear()
         self.client_unauthorized = APIClient()
         self.client = APIClient()
         self.client_superuser = APIClient()
@@ -62,6 +87,159 @@ class TestBankAPIViews(TestCase):
         self.assertEqual(BankAccount.objects.count(), 2)
         self.assertEqual(len(response.data['results']), BankAccount.objects.count())
 
+    def test_get_bank_accounts_cache_invalidated_by_writes(self):
+        response = self.client_staffuser.get(reverse('bankaccount-list'))
+        self.assertEqual(len(response.data['results']), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bank_account = BankAccount.objects.create(user=User.objects.first(), balance=20)
+        response = self.client_staffuser.get(reverse('bankaccount-list'))
+        self.assertEqual(len(response.data['results']), 1)
+
+        BankAccount.objects.filter(pk=bank_account.pk).update(balance=30)
+        response = self.client_staffuser.get(reverse('bankaccount-list'))
+        self.assertEqual(Decimal(response.data['results'][0]['balance']), 20)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            transfer_money(bank_account.pk, self.create_bank_account(User.objects.last(), 0).pk, 5)
+        response = self.client_staffuser.get(reverse('bankaccount-list'))
+        self.assertEqual(Decimal(response.data['results'][0]['balance']), 25)
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'bank.example.com'])
+    def test_get_bank_accounts_cached_per_host(self):
+        self.create_bank_account(User.objects.first(), 20)
+
+        response = self.client_staffuser.get(reverse('bankaccount-list'))
+        self.assertTrue(response.data['results'][0]['url'].startswith('http://testserver/'))
+        response = self.client_staffuser.get(reverse('bankaccount-list'), HTTP_HOST='bank.example.com')
+        self.assertTrue(response.data['results'][0]['url'].startswith('http://bank.example.com/'))
+        response = self.client_staffuser.get(reverse('bankaccount-list'), secure=True)
+        self.assertTrue(response.data['results'][0]['url'].startswith('https://testserver/'))
+
+    def test_get_transaction_history_cache_invalidated_by_transfer(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50)
+        bank_account2 = self.create_bank_account(User.objects.last(), 0)
+        history_url = reverse('balance-history', kwargs={'pk': bank_account2.pk})
+        response = self.client_staffuser.get(history_url)
+        self.assertEqual(len(response.data['results']), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            transfer_money(bank_account1.pk, bank_account2.pk, 5)
+        response = self.client_staffuser.get(history_url)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_get_bank_accounts_sparse_fields(self):
+        self.create_bank_account(User.objects.first(), 20)
+
+        response = self.client_staffuser.get(reverse('bankaccount-list'), {'fields': 'id,balance'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'balance'})
+
+        response = self.client_staffuser.get(reverse('bankaccount-list'), {'compact': '1'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'user', 'balance'})
+
+        response = self.client_staffuser.get(reverse('user-list'), {'compact': '1', 'fields': 'url,id,username'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'username'})
+
+    def test_get_transaction_history_sparse_fields(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50)
+        bank_account2 = self.create_bank_account(User.objects.last(), 0)
+        for _ in range(3):
+            transfer_money(bank_account1.pk, bank_account2.pk, 1)
+        history_url = reverse('balance-history', kwargs={'pk': bank_account1.pk})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_staffuser.get(history_url, {'fields': 'id,amount', 'page_size': 2})
+        self.assertEqual([set(action) for action in response.data['results']], [{'id', 'amount'}] * 2)
+        history_query = next(query['sql'] for query in queries if 'accounts_balanceaction' in query['sql'])
+        self.assertNotIn('balance_after', history_query)
+        self.assertNotIn('auth_user', history_query)
+
+        response = self.client_staffuser.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+
+        response = self.client_staffuser.get(history_url, {'fields': 'message'})
+        expected_message = f'Withdrawn 1.00 for {User.objects.last().username}#{bank_account2.pk}'
+        self.assertEqual(response.data['results'][0]['message'], expected_message)
+
+    @override_settings(PAGINATION_COUNT_MODES={'BankAccountViewSet': 'none'})
+    def test_get_bank_accounts_without_count(self):
+        for balance in range(3):
+            self.create_bank_account(User.objects.first(), balance)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_staffuser.get(reverse('bankaccount-list'), {'limit': 2})
+        self.assertIsNone(response.data['count'])
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+        response = self.client_staffuser.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+    @override_settings(PAGINATION_COUNT_MODES={'BankAccountViewSet': 'estimate'})
+    def test_get_bank_accounts_estimated_count_falls_back_to_exact(self):
+        for balance in range(3):
+            self.create_bank_account(User.objects.first(), balance)
+
+        response = self.client_staffuser.get(reverse('bankaccount-list'), {'limit': 2})
+        self.assertEqual(response.data['count'], 3)
+        self.assertIsNotNone(response.data['next'])
+
+    @override_settings(PAGINATION_COUNT_MODES={'BankAccountViewSet': 'cached'}, PAGINATION_COUNT_CACHE_TTL=60)
+    def test_get_bank_accounts_cached_count(self):
+        self.create_bank_account(User.objects.first(), 10)
+        response = self.client_staffuser.get(reverse('bankaccount-list'), {'limit': 1})
+        self.assertEqual(response.data['count'], 1)
+
+        self.create_bank_account(User.objects.first(), 20)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_staffuser.get(reverse('bankaccount-list'), {'limit': 5})
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+    def test_get_bank_accounts_filtered_and_ordered(self):
+        arisha = User.objects.get(username='arishabarron')
+        branden = User.objects.get(username='brandenbibson')
+        bhonda = User.objects.get(username='bhondachurch')
+        account1 = self.create_bank_account(arisha, 10)
+        account2 = self.create_bank_account(branden, 50)
+        account3 = self.create_bank_account(bhonda, 30)
+        account4 = self.create_bank_account(branden, 30)
+
+        def listed(params):
+            response = self.client_staffuser.get(reverse('bankaccount-list'), params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [item['id'] for item in response.data['results']]
+
+        self.assertEqual(listed({'user': branden.pk}), [account2.pk, account4.pk])
+        self.assertEqual(listed({'username': 'b'}), [account2.pk, account3.pk, account4.pk])
+        self.assertEqual(listed({'username': 'bh'}), [account3.pk])
+        self.assertEqual(listed({'balance_min': 20, 'balance_max': '30.00'}), [account3.pk, account4.pk])
+        self.assertEqual(listed({'ordering': 'balance'}), [account1.pk, account3.pk, account4.pk, account2.pk])
+        self.assertEqual(listed({'ordering': '-balance'}), [account2.pk, account4.pk, account3.pk, account1.pk])
+        self.assertEqual(listed({'username': 'b', 'ordering': '-id', 'limit': 2}), [account4.pk, account3.pk])
+
+        response = self.client_staffuser.get(reverse('bankaccount-list'), {'balance_min': 'much'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('balance_min', response.data)
+
+    def test_search_users_by_prefix(self):
+        User.objects.filter(username='brandenbibson').update(email='branden@example.com')
+        User.objects.filter(username='arishabarron').update(email='bank-ops@example.com')
+
+        def searched(prefix):
+            response = self.client_staffuser.get(reverse('user-list'), {'search': prefix, 'fields': 'username'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return sorted(item['username'] for item in response.data['results'])
+
+        self.assertEqual(searched('b'), ['arishabarron', 'bhondachurch', 'brandenbibson'])
+        self.assertEqual(searched('br'), ['brandenbibson'])
+        self.assertEqual(searched('bank'), ['arishabarron'])
+        # Prefixes only, not substrings
+        self.assertEqual(searched('hazel'), [])
+
     def test_get_bank_accounts_with_not_staff_forbidden(self):
         response = self.client.get(reverse('bankaccount-list'))
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -114,6 +292,54 @@ class TestBankAPIViews(TestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(user.bankaccount_set.count(), 2)
 
+    def test_create_bank_accounts_in_bulk(self):
+        users = list(User.objects.all())
+        bankaccounts_data = [{'user': user.id, 'balance': '10.00'} for user in users]
+
+        self.client_staffuser.get(reverse('bankaccount-list'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_staffuser.post(reverse('bankaccount-list'), bankaccounts_data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), len(users))
+        self.assertEqual({item['user'] for item in response.data}, {user.id for user in users})
+        self.assertTrue(all(item['id'] for item in response.data))
+        self.assertEqual(BankAccount.objects.count(), len(users))
+        user_queries = [query for query in queries.captured_queries if 'FROM "auth_user"' in query['sql']]
+        self.assertLessEqual(len(user_queries), 2)
+
+    def test_create_bank_accounts_in_bulk_with_missing_user(self):
+        bankaccounts_data = [
+            {'user': User.objects.first().id, 'balance': '10.00'},
+            {'user': 0, 'balance': '10.00'},
+        ]
+
+        response = self.client_staffuser.post(reverse('bankaccount-list'), bankaccounts_data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('user', response.data[1])
+        self.assertEqual(BankAccount.objects.count(), 0)
+
+    @override_settings(BULK_CREATE_MAX_SIZE=2)
+    def test_create_bank_accounts_in_bulk_over_limit(self):
+        bankaccounts_data = [{'user': user.id, 'balance': '10.00'} for user in User.objects.all()[:3]]
+        serializer = BankAccountSerializer(data=bankaccounts_data, many=True)
+
+        # Rejected before the users of the items are looked up
+        with self.assertNumQueries(0):
+            self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, {'non_field_errors': ['Ensure there are no more than 2 items.']})
+
+        response = self.client_staffuser.post(reverse('bankaccount-list'), bankaccounts_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(BankAccount.objects.count(), 0)
+
+    def test_create_bank_accounts_in_bulk_empty(self):
+        response = self.client_staffuser.post(reverse('bankaccount-list'), [], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'non_field_errors': ['This list may not be empty.']})
+
     def test_transfers_between_different_user_accounts(self):
         user1 = User.objects.first()
         user2 = User.objects.last()
@@ -156,6 +382,139 @@ class TestBankAPIViews(TestCase):
         self.assertEqual(bank_account1.balance, user1_init_balance)
         self.assertEqual(bank_account2.balance, user2_init_balance)
 
+    def test_transfers_with_invalid_amount_rejected(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 10)
+        bank_account2 = self.create_bank_account(User.objects.last(), 10)
+        url = reverse('transfer', kwargs={'pk': bank_account1.pk})
+
+        for amount in (-5, 0, '0.001', 'abc', 'NaN'):
+            response = self.client_staffuser.post(url, {'amount': amount, 'transferee': bank_account2.pk})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, amount)
+            self.assertIn('amount', response.data)
+        response = self.client_staffuser.post(url, {'amount': 1, 'transferee': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        for amount in (-5, Decimal('0.001')):
+            with self.assertRaises(exceptions.ValidationError):
+                transfer_money(bank_account1.pk, bank_account2.pk, amount)
+
+        bank_account1.refresh_from_db()
+        bank_account2.refresh_from_db()
+        self.assertEqual((bank_account1.balance, bank_account2.balance), (10, 10))
+        self.assertFalse(BalanceAction.objects.exists())
+
+    def test_async_transfer_processed_by_worker(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50)
+        bank_account2 = self.create_bank_account(User.objects.last(), 10)
+
+        response = self.client_staffuser.post(
+            reverse('transfer', kwargs={'pk': bank_account1.pk}),
+            {'amount': 12.5, 'transferee': bank_account2.pk},
+            HTTP_PREFER='respond-async')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'pending')
+        bank_account1.refresh_from_db()
+        self.assertEqual(bank_account1.balance, 50)
+
+        call_command('process_transfers', once=True, stdout=StringIO())
+
+        bank_account1.refresh_from_db()
+        bank_account2.refresh_from_db()
+        self.assertEqual(bank_account1.balance, Decimal('37.5'))
+        self.assertEqual(bank_account2.balance, Decimal('22.5'))
+        response = self.client_staffuser.get(response['Location'])
+        self.assertEqual(response.data['status'], 'completed')
+
+    def test_async_transfer_rejected_by_worker(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 5)
+        bank_account2 = self.create_bank_account(User.objects.last(), 10)
+
+        response = self.client_staffuser.post(
+            reverse('transfer', kwargs={'pk': bank_account1.pk}),
+            {'amount': 12.5, 'transferee': bank_account2.pk},
+            HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        call_command('process_transfers', once=True, stdout=StringIO())
+
+        response = self.client_staffuser.get(response['Location'])
+        self.assertEqual(response.data['status'], 'rejected')
+        self.assertEqual(response.data['result']['detail'], 'Not enough money available')
+        bank_account1.refresh_from_db()
+        self.assertEqual(bank_account1.balance, 5)
+
+    def test_async_transfer_with_invalid_amount_rejected(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 5)
+        bank_account2 = self.create_bank_account(User.objects.last(), 10)
+
+        for amount in (-5, 0):
+            response = self.client_staffuser.post(
+                reverse('transfer', kwargs={'pk': bank_account1.pk}),
+                {'amount': amount, 'transferee': bank_account2.pk},
+                HTTP_PREFER='respond-async')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with self.assertRaises(exceptions.ValidationError):
+            enqueue_transfer(bank_account1.pk, bank_account2.pk, -5)
+        self.assertFalse(PendingTransfer.objects.exists())
+
+        # Stored before amounts were validated
+        PendingTransfer.objects.create(from_account=bank_account1, to_account=bank_account2, amount=-5)
+        call_command('process_transfers', once=True, stdout=StringIO())
+
+        self.assertEqual(PendingTransfer.objects.get().status, 'rejected')
+        bank_account2.refresh_from_db()
+        self.assertEqual(bank_account2.balance, 10)
+
+    def test_transfers_to_missing_account_not_found(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50.25)
+
+        response = self.client_staffuser.post(
+            reverse('transfer', kwargs={'pk': bank_account1.pk}),
+            {'amount': 12.5, 'transferee': bank_account1.pk + 1})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        bank_account1.refresh_from_db()
+        self.assertEqual(bank_account1.balance, Decimal('50.25'))
+        self.assertEqual(bank_account1.balanceaction_set.count(), 0)
+
+    def test_transfer_retried_with_idempotency_key(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50)
+        bank_account2 = self.create_bank_account(User.objects.last(), 0)
+        url = reverse('transfer', kwargs={'pk': bank_account1.pk})
+        data = {'amount': 10, 'transferee': bank_account2.pk}
+
+        first = self.client_staffuser.post(url, data, HTTP_IDEMPOTENCY_KEY='transfer-1')
+        retry = self.client_staffuser.post(url, data, HTTP_IDEMPOTENCY_KEY='transfer-1')
+
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(retry.content), json.loads(first.content))
+        bank_account1.refresh_from_db()
+        self.assertEqual(bank_account1.balance, 40)
+        self.assertEqual(bank_account1.balanceaction_set.count(), 1)
+
+        response = self.client_staffuser.post(url, {**data, 'amount': 20}, HTTP_IDEMPOTENCY_KEY='transfer-1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client_staffuser.post(url, data, HTTP_IDEMPOTENCY_KEY='transfer-2')
+        self.assertNotIn('Idempotent-Replayed', response)
+        bank_account1.refresh_from_db()
+        self.assertEqual(bank_account1.balance, 30)
+
+    def test_expire_idempotency_keys(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50)
+        bank_account2 = self.create_bank_account(User.objects.last(), 0)
+        for key in ('old-1', 'old-2', 'new'):
+            self.client_staffuser.post(
+                reverse('transfer', kwargs={'pk': bank_account1.pk}),
+                {'amount': 1, 'transferee': bank_account2.pk}, HTTP_IDEMPOTENCY_KEY=key)
+        IdempotencyKey.objects.filter(key__startswith='old').update(created_at=timezone.now() - timedelta(days=2))
+
+        call_command('expire_idempotency_keys', '--batch-size', '1', stdout=StringIO())
+
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
+
     def test_transfers_between_same_user_accounts(self):
         user1 = User.objects.first()
 
@@ -176,6 +535,101 @@ class TestBankAPIViews(TestCase):
         self.assertEqual(bank_account1.balance, account1_init_balance - transfer_data['amount'])
         self.assertEqual(bank_account2.balance, account2_init_balance + transfer_data['amount'])
 
+    def test_batch_transfer_applies_all_transfers(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50)
+        bank_account2 = self.create_bank_account(User.objects.last(), 10)
+        bank_account3 = self.create_bank_account(User.objects.last(), 0)
+
+        transfers = [
+            {'transferer': bank_account1.pk, 'transferee': bank_account2.pk, 'amount': 20},
+            {'transferer': bank_account2.pk, 'transferee': bank_account3.pk, 'amount': 25},
+            {'transferer': bank_account3.pk, 'transferee': bank_account1.pk, 'amount': 5},
+        ]
+        response = self.client_staffuser.post(reverse('batch-transfer'), {'transfers': transfers}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.data['results']], ['completed'] * 3)
+        bank_account1.refresh_from_db()
+        bank_account2.refresh_from_db()
+        bank_account3.refresh_from_db()
+        self.assertEqual(bank_account1.balance, 35)
+        self.assertEqual(bank_account2.balance, 5)
+        self.assertEqual(bank_account3.balance, 20)
+        self.assertEqual(bank_account1.balanceaction_set.count(), 2)
+        self.assertEqual(bank_account3.balanceaction_set.count(), 2)
+
+    def test_batch_transfer_rejects_single_items(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50)
+        bank_account2 = self.create_bank_account(User.objects.last(), 10)
+
+        transfers = [
+            {'transferer': bank_account1.pk, 'transferee': bank_account2.pk, 'amount': 60},
+            {'transferer': bank_account1.pk, 'transferee': bank_account1.pk, 'amount': 1},
+            {'transferer': bank_account1.pk, 'transferee': 0, 'amount': 1},
+            {'transferer': bank_account1.pk, 'transferee': bank_account2.pk, 'amount': 50},
+        ]
+        response = self.client_staffuser.post(reverse('batch-transfer'), {'transfers': transfers}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['rejected', 'rejected', 'rejected', 'completed']
+        )
+        bank_account1.refresh_from_db()
+        bank_account2.refresh_from_db()
+        self.assertEqual(bank_account1.balance, 0)
+        self.assertEqual(bank_account2.balance, 60)
+        self.assertEqual(bank_account1.balanceaction_set.count(), 1)
+
+    @override_settings(BATCH_TRANSFER_MAX_SIZE=2)
+    def test_batch_transfer_over_limit_rejected_before_items(self):
+        transfers = [{'transferer': 1, 'transferee': 2, 'amount': 'abc'}] * 3
+
+        with mock.patch.object(BatchTransferItemSerializer, 'run_validation') as validate_item:
+            response = self.client_staffuser.post(
+                reverse('batch-transfer'), {'transfers': transfers}, format='json'
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'transfers': ['Ensure this field has no more than 2 elements.']})
+        validate_item.assert_not_called()
+
+    def test_transfers_with_balance_slots(self):
+        merchant_account = self.create_bank_account(User.objects.first(), 10)
+        customer_account = self.create_bank_account(User.objects.last(), 100)
+        call_command('set_balance_slots', merchant_account.pk, 4, stdout=StringIO())
+        for amount in (20, 30):
+            transfer_money(customer_account.pk, merchant_account.pk, amount)
+
+        merchant_account.refresh_from_db()
+        self.assertEqual(merchant_account.balance, 10)
+        self.assertEqual(merchant_account.balanceslot_set.aggregate(total=Sum('balance'))['total'], 50)
+        response = self.client_staffuser.get(reverse('bankaccount-detail', kwargs={'pk': merchant_account.pk}))
+        self.assertEqual(Decimal(response.data['balance']), 60)
+        response = self.client_staffuser.get(reverse('bankaccount-list'), {'fields': 'id,balance'})
+        self.assertEqual(Decimal(response.data['results'][0]['balance']), 60)
+        history = self.client_staffuser.get(reverse('balance-history', kwargs={'pk': merchant_account.pk})).data
+        self.assertEqual(Decimal(history['results'][0]['balance_after']), 60)
+
+        # Debits may use the money held in the slots, but not more
+        result = transfer_money(merchant_account.pk, customer_account.pk, 45)
+        self.assertEqual(result['New transferer balance'], 15)
+        with self.assertRaises(exceptions.PermissionDenied):
+            transfer_money(merchant_account.pk, customer_account.pk, 16)
+        results = transfer_money_batch([
+            {'from_account': merchant_account.pk, 'to_account': customer_account.pk, 'amount': 16},
+            {'from_account': merchant_account.pk, 'to_account': customer_account.pk, 'amount': 15},
+        ])
+        self.assertEqual([result['status'] for result in results], ['rejected', 'completed'])
+
+        transfer_money(customer_account.pk, merchant_account.pk, 5)
+        call_command('compact_balance_slots', stdout=StringIO())
+        merchant_account.refresh_from_db()
+        self.assertEqual(merchant_account.balance, 5)
+        self.assertEqual(merchant_account.total_deposited, 55)
+        self.assertEqual(merchant_account.transfer_count, 5)
+        self.assertFalse(merchant_account.balanceslot_set.exclude(balance=0).exists())
+
     def check_balance_history_length(self, bank_account_pk, history_length):
         response = self.client_staffuser.get(reverse('balance-history', kwargs={'pk': bank_account_pk}))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -212,6 +666,382 @@ class TestBankAPIViews(TestCase):
         self.assertEqual(bank_account2.balanceaction_set.count(), 2)
         self.check_balance_history_length(bank_account2.pk, 2)
 
+    def test_get_transaction_history_ledger_columns(self):
+        user1 = User.objects.first()
+        user2 = User.objects.last()
+        bank_account1 = self.create_bank_account(user1, 50)
+        bank_account2 = self.create_bank_account(user2, 10)
+
+        self.client_staffuser.post(
+            reverse('transfer', kwargs={'pk': bank_account1.pk}),
+            {'amount': 12.5, 'transferee': bank_account2.pk})
+
+        response = self.client_staffuser.get(reverse('balance-history', kwargs={'pk': bank_account2.pk}))
+        action = response.data['results'][0]
+        self.assertEqual(action['direction'], 'deposit')
+        self.assertEqual(Decimal(action['amount']), Decimal('12.5'))
+        self.assertEqual(Decimal(action['balance_after']), Decimal('22.5'))
+        self.assertEqual(action['counterparty_account'], bank_account1.pk)
+        self.assertEqual(action['message'], f'Deposited 12.50 by {user1.username}#{bank_account1.pk}')
+
+    def test_get_transaction_history_cursor_pages(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50)
+        bank_account2 = self.create_bank_account(User.objects.last(), 0)
+        for _ in range(5):
+            self.client_staffuser.post(
+                reverse('transfer', kwargs={'pk': bank_account1.pk}),
+                {'amount': 1, 'transferee': bank_account2.pk})
+
+        url = reverse('balance-history', kwargs={'pk': bank_account1.pk}) + '?page_size=2'
+        action_ids = []
+        while url:
+            response = self.client_staffuser.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            action_ids.extend(action['id'] for action in response.data['results'])
+            url = response.data['next']
+
+        expected_ids = list(
+            bank_account1.balanceaction_set.order_by('-performed_at', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(action_ids, expected_ids)
+
+    def test_get_transaction_history_across_archive(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50)
+        bank_account2 = self.create_bank_account(User.objects.last(), 0)
+        for amount in range(1, 7):
+            transfer_money(bank_account1.pk, bank_account2.pk, amount)
+        actions = list(bank_account1.balanceaction_set.order_by('id'))
+        for days, action in zip((500, 450, 400), actions):
+            BalanceAction.objects.filter(pk=action.pk).update(performed_at=timezone.now() - timedelta(days=days))
+        expected_ids = [action.pk for action in reversed(actions)]
+        moment = timezone.now() - timedelta(days=420)
+
+        call_command('archive_history', keep_months=3, batch_size=2, stdout=StringIO())
+
+        self.assertEqual(bank_account1.balanceaction_set.count(), 3)
+        self.assertEqual(bank_account1.balanceactionarchive_set.count(), 3)
+        url = reverse('balance-history', kwargs={'pk': bank_account1.pk}) + '?page_size=2'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_staffuser.get(url)
+        # Only the boundary of the archive is read, the first page is hot
+        archive_queries = [query['sql'] for query in queries if 'accounts_balanceactionarchive' in query['sql']]
+        self.assertEqual(len(archive_queries), 1)
+        self.assertIn('MAX(', archive_queries[0])
+        action_ids = [action['id'] for action in response.data['results']]
+        while response.data['next']:
+            response = self.client_staffuser.get(response.data['next'])
+            action_ids.extend(action['id'] for action in response.data['results'])
+        self.assertEqual(action_ids, expected_ids)
+
+        response = self.client_staffuser.get(reverse('balance-history-export', kwargs={'pk': bank_account1.pk}))
+        rows = list(csv.DictReader(line.decode('utf-8') for line in response.streaming_content))
+        self.assertEqual([int(row['id']) for row in rows], expected_ids[::-1])
+        self.check_balance_at(bank_account1.pk, moment, Decimal(47))
+
+    def test_get_transaction_history_archived_by_other_process(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50)
+        bank_account2 = self.create_bank_account(User.objects.last(), 0)
+        for amount in (1, 2, 3):
+            transfer_money(bank_account1.pk, bank_account2.pk, amount)
+        action = bank_account1.balanceaction_set.order_by('id').first()
+        BalanceAction.objects.filter(pk=action.pk).update(performed_at=timezone.now() - timedelta(days=400))
+        moment = timezone.now() - timedelta(days=300)
+        self.check_balance_at(bank_account1.pk, moment, Decimal(49))
+
+        # Moved without going through this process (and its cache), like `archive_history` run elsewhere
+        archive_rows(timezone.now() - timedelta(days=90), batch_size=10)
+
+        self.assertTrue(bank_account1.balanceactionarchive_set.exists())
+        self.check_balance_at(bank_account1.pk, moment, Decimal(49))
+        response = self.client_staffuser.get(reverse('balance-history-export', kwargs={'pk': bank_account1.pk}))
+        rows = list(csv.DictReader(line.decode('utf-8') for line in response.streaming_content))
+        self.assertEqual(len(rows), 3)
+
+    def test_export_transaction_history(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50)
+        bank_account2 = self.create_bank_account(User.objects.last(), 0)
+        for amount in (1, 2, 3):
+            transfer_money(bank_account1.pk, bank_account2.pk, amount)
+        export_url = reverse('balance-history-export', kwargs={'pk': bank_account1.pk})
+
+        response = self.client_staffuser.get(export_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(line.decode('utf-8') for line in response.streaming_content))
+        self.assertEqual([Decimal(row['amount']) for row in rows], [1, 2, 3])
+        self.assertEqual({row['direction'] for row in rows}, {'withdrawal'})
+
+        response = self.client_staffuser.get(export_url, {'output': 'ndjson', 'since': timezone.now().isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+        response = self.client_staffuser.get(export_url, {'output': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['balance_after'] for row in rows], ['49.00', '47.00', '44.00'])
+
+    def test_get_bank_account_summary(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50)
+        bank_account2 = self.create_bank_account(User.objects.last(), 0)
+        transfer_money(bank_account1.pk, bank_account2.pk, 10)
+        transfer_money(bank_account2.pk, bank_account1.pk, 4)
+        transfer_money_batch([{'from_account': bank_account1.pk, 'to_account': bank_account2.pk, 'amount': 1}])
+
+        response = self.client_staffuser.get(reverse('bankaccount-summary', kwargs={'pk': bank_account1.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Decimal(response.data['total_deposited']), 4)
+        self.assertEqual(Decimal(response.data['total_withdrawn']), 11)
+        self.assertEqual(response.data['transfer_count'], 3)
+        self.assertIsNotNone(response.data['last_activity_at'])
+
+        response = self.client_staffuser.get(reverse('bankaccount-list'), {'summary': 1})
+        summaries = {item['id']: item for item in response.data['results']}
+        self.assertEqual(Decimal(summaries[bank_account2.pk]['total_deposited']), 11)
+
+    def test_get_bank_account_summary_with_balance_slots(self):
+        merchant_account = self.create_bank_account(User.objects.first(), 100)
+        customer_account = self.create_bank_account(User.objects.last(), 50)
+        call_command('set_balance_slots', merchant_account.pk, 4, stdout=StringIO())
+        transfer_money(customer_account.pk, merchant_account.pk, 10)
+
+        response = self.client_staffuser.get(reverse('bankaccount-summary', kwargs={'pk': merchant_account.pk}))
+
+        self.assertEqual(Decimal(response.data['balance']), 110)
+        self.assertEqual(Decimal(response.data['total_deposited']), 10)
+        self.assertEqual(response.data['transfer_count'], 1)
+        self.assertIsNotNone(response.data['last_activity_at'])
+
+        response = self.client_staffuser.get(
+            reverse('bankaccount-list'), {'summary': 1, 'fields': 'id,total_deposited,transfer_count'}
+        )
+        summaries = {item['id']: item for item in response.data['results']}
+        self.assertEqual(summaries[merchant_account.pk], {
+            'id': merchant_account.pk, 'total_deposited': '10.00', 'transfer_count': 1
+        })
+
+    def test_backfill_account_summaries(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50)
+        bank_account2 = self.create_bank_account(User.objects.last(), 0)
+        transfer_money(bank_account1.pk, bank_account2.pk, 10)
+        transfer_money(bank_account2.pk, bank_account1.pk, 4)
+        BankAccount.objects.update(total_deposited=0, total_withdrawn=0, transfer_count=0, last_activity_at=None)
+
+        call_command('backfill_account_summaries', chunk_size=1, stdout=StringIO())
+
+        bank_account2.refresh_from_db()
+        self.assertEqual(bank_account2.total_deposited, 10)
+        self.assertEqual(bank_account2.total_withdrawn, 4)
+        self.assertEqual(bank_account2.transfer_count, 2)
+        self.assertIsNotNone(bank_account2.last_activity_at)
+
+    def check_balance_at(self, bank_account_pk, moment, balance):
+        response = self.client_staffuser.get(
+            reverse('balance-at', kwargs={'pk': bank_account_pk}), {'t': moment.isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Decimal(response.data['balance']), balance)
+
+    def test_get_balance_at_with_checkpoints(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50)
+        bank_account2 = self.create_bank_account(User.objects.last(), 0)
+        for amount in (1, 2, 3, 4, 5):
+            transfer_money(bank_account1.pk, bank_account2.pk, amount)
+
+        start = timezone.now() - timedelta(days=1)
+        for hours, action in enumerate(bank_account1.balanceaction_set.order_by('id'), start=1):
+            BalanceAction.objects.filter(pk=action.pk).update(performed_at=start + timedelta(hours=hours))
+        moments = [start + timedelta(hours=hours, minutes=30) for hours in range(6)]
+        expected_balances = [Decimal(balance) for balance in (50, 49, 47, 44, 40, 35)]
+
+        for moment, balance in zip(moments, expected_balances):
+            self.check_balance_at(bank_account1.pk, moment, balance)
+
+        call_command('create_balance_checkpoints', interval=2, settle_seconds=0, stdout=StringIO())
+        self.assertEqual(BalanceCheckpoint.objects.filter(bank_account=bank_account1).count(), 2)
+
+        for moment, balance in zip(moments, expected_balances):
+            self.check_balance_at(bank_account1.pk, moment, balance)
+
+    def test_get_balance_at_invalid_moment(self):
+        bank_account1 = self.create_bank_account(User.objects.first(), 50)
+        response = self.client_staffuser.get(reverse('balance-at', kwargs={'pk': bank_account1.pk}), {'t': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestMetrics(TestCase):
+    fixtures = ['user-data.json']
+
+    def test_metrics_exposed_for_resolved_views(self):
+        client = TestBankAPIViews.create_authenticated_client(username='staffuser', password='123457')
+        bank_account1 = BankAccount.objects.create(user=User.objects.first(), balance=10)
+        bank_account2 = BankAccount.objects.create(user=User.objects.last(), balance=0)
+        client.post(reverse('transfer', kwargs={'pk': bank_account1.pk}), {'amount': 1, 'transferee': bank_account2.pk})
+        client.get(reverse('bankaccount-list'))
+
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = response.content.decode('utf-8')
+        self.assertIn('http_request_duration_seconds_count{view="TransferApiView",method="POST",status="200"}', content)
+        self.assertIn('http_request_db_queries_count{view="BankAccountViewSet.list",method="GET"}', content)
+        self.assertIn('transfers_total{outcome="completed"}', content)
+
+
+class TestRenderers(TestCase):
+    fixtures = ['user-data.json']
+
+    def setUp(self):
+        cache.clear()
+        self.client = TestBankAPIViews.create_authenticated_client(username='staffuser', password='123457')
+        self.bank_account1 = BankAccount.objects.create(user=User.objects.first(), balance=Decimal('100.10'))
+        self.bank_account2 = BankAccount.objects.create(user=User.objects.last(), balance=0)
+
+    def test_json_keeps_decimal_amounts(self):
+        response = self.client.post(
+            reverse('transfer', kwargs={'pk': self.bank_account1.pk}),
+            json.dumps({'amount': 0.3, 'transferee': self.bank_account2.pk}),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content)['New transferer balance'], '99.80')
+
+    def test_msgpack_chosen_by_accept_header(self):
+        response = self.client.post(
+            reverse('transfer', kwargs={'pk': self.bank_account1.pk}),
+            msgpack.packb({'amount': '1.10', 'transferee': self.bank_account2.pk}),
+            content_type='application/msgpack'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(reverse('bankaccount-list'), HTTP_ACCEPT='application/msgpack')
+
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        results = msgpack.unpackb(response.content)['results']
+        self.assertEqual({item['id']: item['balance'] for item in results}, {
+            self.bank_account1.pk: '99.00',
+            self.bank_account2.pk: '1.10',
+        })
+
+    def test_invalid_json_rejected(self):
+        response = self.client.post(
+            reverse('transfer', kwargs={'pk': self.bank_account1.pk}), '{"amount": ', content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestBasicAuthCache(TestCase):
+    fixtures = ['user-data.json']
+
+    def setUp(self):
+        cache.clear()
+        self.client = TestBankAPIViews.create_authenticated_client(username='staffuser', password='123457')
+
+    def test_repeated_requests_skip_password_hashing(self):
+        with mock.patch('django.contrib.auth.base_user.check_password', wraps=check_password) as hasher:
+            for _ in range(3):
+                response = self.client.get(reverse('bankaccount-list'))
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(hasher.call_count, 1)
+
+    def test_changed_password_invalidates_cached_credentials(self):
+        response = self.client.get(reverse('bankaccount-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        user = User.objects.get(username='staffuser')
+        user.set_password('changed-password')
+        user.save()
+
+        response = self.client.get(reverse('bankaccount-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_rejected(self):
+        response = self.client.get(reverse('bankaccount-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        User.objects.filter(username='staffuser').update(is_active=False)
+
+        response = self.client.get(reverse('bankaccount-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class TestAdmissionControl(TestCase):
+    fixtures = ['user-data.json']
+
+    def setUp(self):
+        cache.clear()
+        self.client = TestBankAPIViews.create_authenticated_client(username='staffuser', password='123457')
+        self.bank_account1 = BankAccount.objects.create(user=User.objects.first(), balance=10)
+        self.bank_account2 = BankAccount.objects.create(user=User.objects.last(), balance=0)
+
+    def test_lists_rate_limited_per_user(self):
+        rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'lists': '2/min'}}
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            for _ in range(2):
+                self.assertEqual(self.client.get(reverse('bankaccount-list')).status_code, status.HTTP_200_OK)
+            # Other actions and other users are not limited by the used up bucket
+            response = self.client.get(reverse('bankaccount-detail', kwargs={'pk': self.bank_account1.pk}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            superuser_client = TestBankAPIViews.create_authenticated_client(username='admin', password='12345')
+            self.assertEqual(superuser_client.get(reverse('bankaccount-list')).status_code, status.HTTP_200_OK)
+
+            response = self.client.get(reverse('bankaccount-list'))
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '30')
+
+    def test_transfers_rate_limited(self):
+        rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'transfers': '1/s'}}
+        url = reverse('transfer', kwargs={'pk': self.bank_account1.pk})
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            response = self.client.post(url, {'amount': 1, 'transferee': self.bank_account2.pk})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.post(url, {'amount': 1, 'transferee': self.bank_account2.pk})
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '1')
+
+        self.bank_account1.refresh_from_db()
+        self.assertEqual(self.bank_account1.balance, 9)
+
+    def test_full_bucket_refilled_without_losing_concurrent_tokens(self):
+        interval, now = 1000, 10 ** 9
+        key = 'throttle:test:1'
+        cache.set(key, now - 5 * interval)
+
+        # The first request seeing the full bucket moves it to now
+        self.assertEqual(TokenBucketThrottle.take_token(key, interval, now), now + interval)
+        # A concurrent request that saw the full bucket as well does not undo tokens taken since
+        cache.set(key, now - 5 * interval)
+        self.assertEqual(TokenBucketThrottle.take_token(key, interval, now), now - 4 * interval)
+        self.assertEqual(TokenBucketThrottle.take_token(key, interval, now), now - 3 * interval)
+        self.assertEqual(cache.get(key), now - 3 * interval)
+
+    def test_transfers_in_flight_counter_expiry_rearmed(self):
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'TRANSFER_CONCURRENCY_LIMIT': 5}):
+            cache.set(TRANSFERS_IN_FLIGHT_KEY, 1, 1)
+            with mock.patch.object(cache, 'touch', wraps=cache.touch) as touch:
+                self.assertTrue(acquire_transfer_slot())
+            touch.assert_called_once_with(TRANSFERS_IN_FLIGHT_KEY, TRANSFERS_IN_FLIGHT_TIMEOUT)
+            self.assertEqual(cache.get(TRANSFERS_IN_FLIGHT_KEY), 2)
+            release_transfer_slot()
+
+    def test_transfers_rejected_over_concurrency_limit(self):
+        url = reverse('transfer', kwargs={'pk': self.bank_account1.pk})
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'TRANSFER_CONCURRENCY_LIMIT': 1}):
+            # Another transfer is in progress
+            cache.set(TRANSFERS_IN_FLIGHT_KEY, 1)
+            response = self.client.post(url, {'amount': 1, 'transferee': self.bank_account2.pk})
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '1')
+            self.assertEqual(cache.get(TRANSFERS_IN_FLIGHT_KEY), 1)
+
+            cache.set(TRANSFERS_IN_FLIGHT_KEY, 0)
+            response = self.client.post(url, {'amount': 1, 'transferee': self.bank_account2.pk})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(cache.get(TRANSFERS_IN_FLIGHT_KEY), 0)
+
 
 class TestAuth(TestCase):
     fixtures = ['user-data.json']
@@ -279,3 +1109,70 @@ class TestAuth(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
         self.assertFalse(User.objects.filter(username=user_data['username']).exists())
+
+    def test_jwt_token_use_without_user_query(self):
+        token = self.obtain_jwt_token('staffuser').data['access']
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+        cache.clear()
+
+        response = self.client.get(reverse('bankaccount-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('bankaccount-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries.captured_queries if 'SELECT' in query['sql']])
+
+    def test_jwt_token_revoked_after_user_deletion(self):
+        tokens = self.obtain_jwt_token('staffuser').data
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+        cache.clear()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.get(username='staffuser').delete()
+
+        response = self.client.get(reverse('bankaccount-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = APIClient().post(reverse('token_refresh'), {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_jwt_token_of_created_user_not_revoked(self):
+        token = self.obtain_jwt_token('admin').data['access']
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+        user_data = {'username': 'newteststaffuser', 'password': '12345ab', 'is_staff': 'true'}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('user-list'), user_data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        client = APIClient()
+        tokens = client.post(reverse('token_obtain_pair'), user_data).data
+        client.credentials(HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+
+        response = client.get(reverse('bankaccount-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = APIClient().post(reverse('token_refresh'), {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_jwt_token_issued_after_revocation_accepted(self):
+        user = User.objects.get(username='staffuser')
+        user.set_password(self.get_user_data('staffuser')['password'])
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        token = self.obtain_jwt_token('staffuser').data['access']
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+
+        response = self.client.get(reverse('bankaccount-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_jwt_token_revoked_after_user_deactivation(self):
+        token = self.obtain_jwt_token('staffuser').data['access']
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+        cache.clear()
+
+        user = User.objects.get(username='staffuser')
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+
+        response = self.client.get(reverse('bankaccount-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,125 @@
+"""
+Admission control in the shared cache.
+
+`TokenBucketThrottle` limits how fast every client calls each class of endpoints (the
+`throttle_scope` of the view), rejected requests get 429 with Retry-After. The transfer
+concurrency cap bounds transfers in progress across all workers, so a burst queues in
+clients instead of on account row locks, rejected transfers get 503 with Retry-After.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import exceptions, status
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+from accounts import metrics
+
+TRANSFERS_IN_FLIGHT_KEY = 'throttle:transfers-in-flight'
+# Counts leaked by killed workers are forgotten this many seconds after the last transfer started
+TRANSFERS_IN_FLIGHT_TIMEOUT = 60
+# Seconds during which a refilled bucket is not refilled again, see `take_token`
+REFILL_TIMEOUT = 1
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Token bucket per user (client address for anonymous requests) and throttle scope of the view.
+    A rate of DEFAULT_THROTTLE_RATES like '600/min' is a bucket of 600 tokens refilled at 600 tokens
+    a minute, so short bursts are allowed while the average stays under the rate. Views without
+    a scope or scopes without a rate are not limited.
+
+    The bucket is stored as the moment it is full again (GCRA) in microseconds, and every request
+    moves it forward by one token interval with an atomic increment. Nothing ever overwrites the
+    stored value, so concurrent workers never lose each other's tokens.
+    """
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def __init__(self):
+        # Rates are read on every request (SimpleRateThrottle requires one at construction)
+        self.wait_seconds = None
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope) if scope else None
+        if not rate:
+            return True
+
+        capacity, period = self.parse_rate(rate)
+        interval = period * 1_000_000 // capacity
+        now = time.time_ns() // 1000
+        ident = request.user.pk if request.user and request.user.is_authenticated else self.get_ident(request)
+        key = self.cache_format % {'scope': scope, 'ident': ident}
+
+        full_at = self.take_token(key, interval, now)
+        if full_at - now <= capacity * interval:
+            return True
+
+        # Rejected requests do not use up tokens
+        cache.decr(key, interval)
+        self.wait_seconds = (full_at - now - capacity * interval) / 1_000_000
+        metrics.throttled_requests.inc(scope)
+        return False
+
+    @staticmethod
+    def take_token(key, interval, now):
+        """Take a token out of the bucket, return the moment it is full again"""
+        try:
+            full_at = cache.incr(key, interval)
+        except ValueError:
+            if cache.add(key, now + interval, None):
+                return now + interval
+            full_at = cache.incr(key, interval)
+        if full_at - interval < now and cache.add(f'{key}:refill', True, REFILL_TIMEOUT):
+            # The bucket was full and tokens do not pile up beyond its capacity: one request moves it to
+            # now, with another increment so tokens taken concurrently stay taken. A bucket full again
+            # within REFILL_TIMEOUT of its last refill is left behind, letting through at most
+            # REFILL_TIMEOUT seconds worth of extra requests.
+            full_at = cache.incr(key, now - (full_at - interval))
+        return full_at
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ServiceOverloaded(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many transfers are in progress, try again shortly.'
+    default_code = 'overloaded'
+
+    def __init__(self, wait=1):
+        super().__init__()
+        # Sent as Retry-After by DRF's exception handler
+        self.wait = wait
+
+
+def acquire_transfer_slot():
+    """
+    Count a transfer in progress, raise ServiceOverloaded above TRANSFER_CONCURRENCY_LIMIT.
+    Returns whether a slot was taken, which then has to be given back with `release_transfer_slot`.
+    """
+    limit = settings.REST_FRAMEWORK.get('TRANSFER_CONCURRENCY_LIMIT')
+    if not limit:
+        return False
+    try:
+        in_flight = cache.incr(TRANSFERS_IN_FLIGHT_KEY)
+    except ValueError:
+        cache.add(TRANSFERS_IN_FLIGHT_KEY, 0, TRANSFERS_IN_FLIGHT_TIMEOUT)
+        in_flight = cache.incr(TRANSFERS_IN_FLIGHT_KEY)
+    # Increments keep the expiry the counter was created with. Without re-arming it the counter would
+    # expire under steady load, and releases of transfers still in progress would undercount the next one.
+    cache.touch(TRANSFERS_IN_FLIGHT_KEY, TRANSFERS_IN_FLIGHT_TIMEOUT)
+    if in_flight > limit:
+        release_transfer_slot()
+        metrics.throttled_requests.inc('transfer-concurrency')
+        raise ServiceOverloaded()
+    return True
+
+
+def release_transfer_slot():
+    try:
+        cache.decr(TRANSFERS_IN_FLIGHT_KEY)
+    except ValueError:
+        # Expired while the transfer was in progress
+        pass
@@ -8,7 +8,13 @@ router.register('bankaccounts', views.BankAccountViewSet)
 router.register('users', views.UserViewSet)
 
 urlpatterns = [
+    path('bankaccounts/batch_transfer/', views.BatchTransferApiView.as_view(), name='batch-transfer'),
     path('', include(router.urls)),
     path('bankaccounts/<int:pk>/make_transfer/', views.TransferApiView.as_view(), name='transfer'),
+    path('transfers/<int:pk>/', views.PendingTransferApiView.as_view(), name='pending-transfer'),
     path('bankaccounts/<int:pk>/history/', views.BalanceHistoryApiView.as_view(), name='balance-history'),
+    path('bankaccounts/<int:pk>/history/export/', views.BalanceHistoryExportApiView.as_view(),
+         name='balance-history-export'),
+    path('bankaccounts/<int:pk>/summary/', views.BankAccountSummaryApiView.as_view(), name='bankaccount-summary'),
+    path('bankaccounts/<int:pk>/balance_at/', views.BalanceAtApiView.as_view(), name='balance-at'),
 ]
@@ -1,49 +1,161 @@
+import csv
+import hashlib
+import json
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
-from django.conf import settings
 from rest_framework import (
     viewsets,
     generics,
     exceptions,
     status
 )
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 
-from accounts.models import BankAccount, BalanceAction
+from accounts import cache, metrics
+from accounts.filters import BankAccountFilter, StableOrderingFilter, PrefixSearchFilter
+from accounts.history import history_queryset
+from accounts.models import BankAccount, PendingTransfer, IdempotencyKey
+from accounts.pagination import BalanceHistoryCursorPagination
 from accounts.serializers import (
     BankAccountSerializer,
+    BankAccountSummarySerializer,
     UserSerializer,
     BalanceActionSerializer,
-    TransferSerializer
+    TransferSerializer,
+    BatchTransferSerializer,
+    BalanceAtSerializer,
+    BalanceHistoryExportSerializer,
+    PendingTransferSerializer,
+    is_sparse_request
 )
 from accounts.services import (
-    transfer_money
+    transfer_money,
+    transfer_money_batch,
+    get_balance_at,
+    enqueue_transfer,
+    run_idempotent
 )
+from accounts.throttling import acquire_transfer_slot, release_transfer_slot
 
 User = get_user_model()
 
 
-class BankAccountViewSet(viewsets.ModelViewSet):
+class SparseFieldsetViewMixin:
+    """Load only the columns needed by the fields selected with the `fields` and `compact` query parameters."""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if not is_sparse_request(self.request):
+            return queryset
+
+        serializer = self.get_serializer()
+        sparse_columns = getattr(serializer.Meta, 'sparse_columns', {})
+        model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+        # Cursor pagination reads the ordering fields of the last row
+        columns = {name.lstrip('-') for name in getattr(self.paginator, 'ordering', ())}
+        for name, field in serializer.fields.items():
+            if not field.write_only:
+                columns.update(sparse_columns.get(name, (field.source,)))
+        columns = {column for column in columns if column.split('__')[0] in model_fields}
+
+        if not any('__' in column for column in columns):
+            queryset = queryset.select_related(None)
+        return queryset.only(*columns)
+
+
+class NonAtomicReadsMixin:
+    """
+    Serve safe requests outside the ATOMIC_REQUESTS transaction of the primary database (their reads
+    may go to a replica), other requests still run in a transaction.
+    """
+
+    @classmethod
+    def as_view(cls, *args, **kwargs):
+        return transaction.non_atomic_requests(super().as_view(*args, **kwargs))
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return super().dispatch(request, *args, **kwargs)
+        with transaction.atomic():
+            return super().dispatch(request, *args, **kwargs)
+
+
+class ListThrottleMixin:
+    """Rate limit listing under the `lists` throttle scope, other actions are not limited"""
+
+    @property
+    def throttle_scope(self):
+        return 'lists' if getattr(self, 'action', 'list') == 'list' else None
+
+
+class TransferAdmissionMixin:
+    """
+    Rate limit transfers under the `transfers` throttle scope and reject them with 503 while
+    TRANSFER_CONCURRENCY_LIMIT transfers are already in progress.
     """
-    list: Get list of all bank accounts.
+    throttle_scope = 'transfers'
+    holds_transfer_slot = False
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.holds_transfer_slot = acquire_transfer_slot()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self.holds_transfer_slot:
+            self.holds_transfer_slot = False
+            release_transfer_slot()
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class BankAccountViewSet(ListThrottleMixin, NonAtomicReadsMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
+    """
+    list: Get list of all bank accounts. With `summary=1` activity counters of every account are included.
+    Fields can be selected with `fields=id,balance`, `compact=1` leaves out hyperlinks.
+
+    Accounts can be filtered by owner with `user=<id>` or `username=<prefix>` and by balance with
+    `balance_min` / `balance_max`, and ordered with `ordering=balance`, `-balance`, `id` or `-id`.
 
     retrieve: Get information about single bank account entry with it's balance.
 
-    create: Create a new bank account for the user.
+    create: Create a new bank account for the user, or many bank accounts at once when a list is sent.
     """
     queryset = BankAccount.objects.all()
     serializer_class = BankAccountSerializer
+    filter_backends = [BankAccountFilter, StableOrderingFilter]
+    ordering_fields = ['balance', 'id']
+    ordering = ['id']
     http_method_names = ['get', 'post', 'head']
 
-    @method_decorator(cache_page(settings.CACHE_TTL))
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=isinstance(request.data, list))
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    def get_serializer_class(self):
+        if self.action == 'list' and self.request.query_params.get('summary') in ('1', 'true'):
+            return BankAccountSummarySerializer
+        return super().get_serializer_class()
+
+    @cache.cache_response(lambda view: [cache.BANK_ACCOUNT_LIST])
     def list(self, request, *args, **kwargs):
         return super(BankAccountViewSet, self).list(request, *args, **kwargs)
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ListThrottleMixin, NonAtomicReadsMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     """
-    list: Get list of all existing users.
+    list: Get list of all existing users. Fields can be selected with `fields=id,username`,
+    `compact=1` leaves out hyperlinks. `search=<prefix>` finds users by the start of their username
+    or email (case sensitive).
 
     retrieve: Get information about specific user.
 
@@ -51,42 +163,210 @@ class UserViewSet(viewsets.ModelViewSet):
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    filter_backends = [PrefixSearchFilter]
+    search_fields = ['^username', '^email']
     http_method_names = ['get', 'post', 'head']
 
-    @method_decorator(cache_page(settings.CACHE_TTL))
+    @cache.cache_response(lambda view: [cache.USER_LIST])
     def list(self, request, *args, **kwargs):
         return super(UserViewSet, self).list(request, *args, **kwargs)
 
 
-class TransferApiView(generics.CreateAPIView):
-    """Make transfer between two users. Create transfer history entry."""
+class TransferApiView(TransferAdmissionMixin, generics.CreateAPIView):
+    """
+    Make transfer between two users. Create transfer history entry.
+
+    With `Prefer: respond-async` header (or ASYNC_TRANSFERS setting) the transfer is only queued
+    and 202 response with the status URL of the pending transfer is returned.
+
+    Retries sent with the same `Idempotency-Key` header get the original response back
+    (with `Idempotent-Replayed: true` header) instead of making the transfer again.
+    """
     serializer_class = TransferSerializer
 
     def post(self, request, *args, **kwargs):
-        from_account_pk = kwargs.get('pk')
-        transfer_amount = self.request.data.get('amount', 0)
-        to_account_pk = self.request.data.get('transferee', None)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        from_account_pk = kwargs['pk']
+        transfer_amount = serializer.validated_data['amount']
+        to_account_pk = serializer.validated_data['transferee']
 
-        try:
-            from_account_pk, to_account_pk = int(from_account_pk), int(to_account_pk)
-        except ValueError:
-            return Response('You have to provide id values of user\'s bank account', status.HTTP_400_BAD_REQUEST)
+        is_async = self.is_async(request)
+        key = request.headers.get('Idempotency-Key')
+        replayed = False
+        if key is None:
+            data, status_code = self.perform_transfer(from_account_pk, to_account_pk, transfer_amount, is_async)
+        elif len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response('Idempotency-Key is too long', status.HTTP_400_BAD_REQUEST)
+        else:
+            fingerprint = hashlib.sha256(
+                f'{from_account_pk}:{to_account_pk}:{transfer_amount}:{is_async}'.encode('utf-8')
+            ).hexdigest()
+            data, status_code, replayed = run_idempotent(
+                request.user.pk, key, fingerprint,
+                lambda: self.perform_transfer(from_account_pk, to_account_pk, transfer_amount, is_async)
+            )
+
+        headers = {}
+        if status_code == status.HTTP_202_ACCEPTED:
+            headers['Location'] = data['status_url']
+        if replayed:
+            metrics.transfers.inc('replayed')
+            headers['Idempotent-Replayed'] = 'true'
+        return Response(data, status=status_code, headers=headers)
+
+    def perform_transfer(self, from_account_pk, to_account_pk, transfer_amount, is_async):
+        """Make or queue the transfer, return response data and status code"""
+        if is_async:
+            try:
+                pending_transfer = enqueue_transfer(from_account_pk, to_account_pk, transfer_amount)
+            except exceptions.APIException as e:
+                metrics.transfers.inc('rejected')
+                return e.detail, e.status_code
+
+            metrics.transfers.inc('queued')
+            status_url = reverse('pending-transfer', kwargs={'pk': pending_transfer.pk}, request=self.request)
+            content = {'id': pending_transfer.pk, 'status': pending_transfer.status, 'status_url': status_url}
+            return content, status.HTTP_202_ACCEPTED
 
         try:
             content = transfer_money(from_account_pk, to_account_pk, transfer_amount)
-        except exceptions.PermissionDenied as e:
-            return Response(e.detail, e.status_code)
+        except exceptions.APIException as e:
+            metrics.transfers.inc('rejected')
+            return e.detail, e.status_code
+
+        metrics.transfers.inc('completed')
+        return content, status.HTTP_200_OK
 
-        return Response(content, status=status.HTTP_200_OK)
+    @staticmethod
+    def is_async(request):
+        preferences = [preference.strip() for preference in request.headers.get('Prefer', '').split(',')]
+        return settings.ASYNC_TRANSFERS or 'respond-async' in preferences
 
 
-class BalanceHistoryApiView(generics.ListAPIView):
-    """Return bank transfer history for a specific user."""
+class PendingTransferApiView(generics.RetrieveAPIView):
+    """Return the processing status of a transfer queued for asynchronous processing."""
+    queryset = PendingTransfer.objects.all()
+    serializer_class = PendingTransferSerializer
+
+
+class BatchTransferApiView(TransferAdmissionMixin, generics.CreateAPIView):
+    """Make many transfers in a single transaction. Return a result for each transfer."""
+    serializer_class = BatchTransferSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        transfers = [
+            {'from_account': item['transferer'], 'to_account': item['transferee'], 'amount': item['amount']}
+            for item in serializer.validated_data['transfers']
+        ]
+        results = transfer_money_batch(transfers)
+        for result in results:
+            metrics.transfers.inc(result['status'])
+
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+class BankAccountSummaryApiView(NonAtomicReadsMixin, generics.RetrieveAPIView):
+    """Return total deposited and withdrawn amounts, transfer count and last activity of a bank account."""
+    queryset = BankAccount.objects.all()
+    serializer_class = BankAccountSummarySerializer
+
+
+class BalanceHistoryApiView(ListThrottleMixin, NonAtomicReadsMixin, SparseFieldsetViewMixin, generics.ListAPIView):
+    """
+    Return bank transfer history for a specific user. Fields can be selected with `fields=id,amount`.
+
+    Archived history is only read once the pages reach past the actions still in the hot table.
+    """
     serializer_class = BalanceActionSerializer
+    pagination_class = BalanceHistoryCursorPagination
 
     def get_queryset(self):
-        return BalanceAction.objects.filter(bank_account_id=self.kwargs.get('pk'))
+        return history_queryset(self.kwargs.get('pk')).select_related('counterparty_account__user')
 
-    @method_decorator(cache_page(settings.CACHE_TTL))
+    @cache.cache_response(lambda view: [cache.balance_history(view.kwargs.get('pk'))])
     def list(self, request, *args, **kwargs):
         return super(BalanceHistoryApiView, self).list(request, *args, **kwargs)
+
+
+class BalanceAtApiView(NonAtomicReadsMixin, generics.GenericAPIView):
+    """Return the balance of a bank account as of the moment given in the `t` query parameter."""
+    serializer_class = BalanceAtSerializer
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        bank_account_pk = kwargs.get('pk')
+        moment = serializer.validated_data['t']
+        balance = get_balance_at(bank_account_pk, moment)
+
+        return Response(self.get_serializer({'t': moment, 'bank_account': bank_account_pk, 'balance': balance}).data)
+
+
+class Echo:
+    """An object implementing just the write method of the file-like interface, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class BalanceHistoryExportApiView(generics.GenericAPIView):
+    """
+    Stream the whole bank transfer history of a bank account as CSV or NDJSON (`output` parameter).
+
+    Optionally limited to the `since` and `until` date range.
+    """
+    serializer_class = BalanceHistoryExportSerializer
+    export_fields = ('id', 'performed_at', 'direction', 'amount', 'counterparty_account', 'balance_after', 'message')
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        bank_account = get_object_or_404(BankAccount, pk=kwargs.get('pk'))
+        actions = history_queryset(bank_account.pk)
+        if 'since' in params:
+            actions = actions.filter(performed_at__gte=params['since'])
+        if 'until' in params:
+            actions = actions.filter(performed_at__lt=params['until'])
+        actions = actions.select_related('counterparty_account__user').order_by('performed_at', 'id')
+        rows = (self.get_row(action) for action in actions.iterator(chunk_size=settings.HISTORY_EXPORT_CHUNK_SIZE))
+
+        if params['output'] == 'ndjson':
+            content_type, extension = 'application/x-ndjson', 'ndjson'
+            content = (json.dumps(dict(zip(self.export_fields, row)), cls=DjangoJSONEncoder) + '\n' for row in rows)
+        else:
+            content_type, extension = 'text/csv', 'csv'
+            writer = csv.writer(Echo())
+            content = (writer.writerow(row) for row in self.with_header(rows))
+
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="bank-account-{bank_account.pk}-history.{extension}"'
+        return response
+
+    def with_header(self, rows):
+        yield self.export_fields
+        yield from rows
+
+    @staticmethod
+    def get_row(action):
+        return (
+            action.id,
+            action.performed_at.isoformat(),
+            action.direction,
+            action.amount,
+            action.counterparty_account_id,
+            action.balance_after,
+            action.message
+        )
+
+
+def metrics_view(request):
+    """Expose request metrics of this process in the Prometheus text format."""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
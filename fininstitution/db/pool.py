@@ -0,0 +1,119 @@
+"""
+In-process pool of database connections, shared by the threads of a worker process.
+
+The pool holds at most SIZE connections. When all of them are borrowed, a thread waits up to
+TIMEOUT seconds for one to be returned instead of opening yet another server connection.
+"""
+import logging
+import threading
+from collections import deque
+
+from django.db import OperationalError, connections
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, size, timeout, health_checks=True):
+        self.size = size
+        self.timeout = timeout
+        self.health_checks = health_checks
+        self.idle = deque()
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+
+    def get(self, connect):
+        """Borrow an idle connection, or open one with `connect` when there is none"""
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f'No database connection became available within {self.timeout}s')
+        try:
+            while True:
+                with self.lock:
+                    connection = self.idle.pop() if self.idle else None
+                if connection is None:
+                    return connect()
+                if self.is_usable(connection):
+                    return connection
+                self.discard(connection)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def put(self, connection):
+        """Return a borrowed connection, unless it is broken"""
+        try:
+            if connection.closed or connection.get_transaction_status() == TRANSACTION_STATUS_UNKNOWN:
+                self.discard(connection)
+                return
+            try:
+                if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                # New connections (see `fill`) start outside autocommit mode. Idle ones are kept in it, or the
+                # health check would open a transaction in which Django cannot turn autocommit on.
+                if not connection.autocommit:
+                    connection.autocommit = True
+            except Exception:
+                self.discard(connection)
+                return
+            with self.lock:
+                self.idle.append(connection)
+        finally:
+            self.slots.release()
+
+    def fill(self, count, connect):
+        """Open connections up to `count` idle ones ahead of the first requests"""
+        with self.lock:
+            missing = min(count, self.size) - len(self.idle)
+        for _ in range(missing):
+            if not self.slots.acquire(blocking=False):
+                return
+            try:
+                connection = connect()
+            except BaseException:
+                self.slots.release()
+                raise
+            self.put(connection)
+
+    def close(self):
+        """Close the idle connections, borrowed ones are closed when they are returned"""
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+        for connection in idle:
+            self.discard(connection)
+
+    def is_usable(self, connection):
+        if connection.closed:
+            return False
+        if not self.health_checks:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except Exception:
+            return False
+        return True
+
+    @staticmethod
+    def discard(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+def warm_up_connections():
+    """Open connections of every database ahead of the first request, call once a worker process starts"""
+    for alias in connections:
+        warm_up = getattr(connections[alias], 'warm_up', None)
+        if warm_up is None:
+            continue
+        try:
+            warm_up()
+        except OperationalError as e:
+            # Requests open their connections themselves once the database is reachable
+            logger.warning('Could not warm up connections of the %s database: %s', alias, e)
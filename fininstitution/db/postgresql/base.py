@@ -0,0 +1,104 @@
+"""
+PostgreSQL backend adding to the Django one:
+
+* CONN_HEALTH_CHECKS - a persistent connection is checked before its first use in a request
+  and replaced when the server closed it in the meantime
+* POOL - with SIZE > 0 connections are borrowed from an in-process pool (see fininstitution.db.pool)
+  for every request and returned to it afterwards, WARMUP connections are opened by `warm_up`
+"""
+import threading
+import time
+
+from django.db.backends.postgresql import base, creation
+
+from fininstitution.db.pool import ConnectionPool
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def close_pools(database_name):
+    """Close the idle pooled connections to a database, which would otherwise prevent dropping it"""
+    with pools_lock:
+        closing = [pool for (alias, name), pool in pools.items() if name == database_name]
+    for pool in closing:
+        pool.close()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+
+    @property
+    def pool(self):
+        pool_settings = self.settings_dict.get('POOL') or {}
+        if not pool_settings.get('SIZE'):
+            return None
+        # Keyed by database name too, the test runner switches an alias to the test database
+        key = (self.alias, self.settings_dict['NAME'])
+        with pools_lock:
+            if key not in pools:
+                pools[key] = ConnectionPool(
+                    pool_settings['SIZE'], pool_settings.get('TIMEOUT', 10),
+                    health_checks=self.settings_dict.get('CONN_HEALTH_CHECKS', False)
+                )
+            return pools[key]
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        connection = pool.get(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        self.isolation_level = self.settings_dict['OPTIONS'].get('isolation_level', connection.isolation_level)
+        return connection
+
+    def connect(self):
+        # A new connection needs no check, and connect() itself calls ensure_connection()
+        self.health_check_done = True
+        super().connect()
+        if self.pool is not None:
+            # Give the connection back to the pool at the end of the request
+            self.close_at = time.monotonic()
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            pool.put(self.connection)
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        # Called when a request starts and finishes
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (
+            self.connection is not None and not self.health_check_done and not self.in_atomic_block
+            and self.settings_dict.get('CONN_HEALTH_CHECKS')
+        ):
+            self.health_check_done = True
+            if not self.is_usable():
+                self.close()
+        super().ensure_connection()
+
+    def warm_up(self):
+        """Fill the pool with POOL['WARMUP'] connections, or open the persistent connection of this thread"""
+        pool = self.pool
+        if pool is not None:
+            conn_params = self.get_connection_params()
+            pool.fill(
+                self.settings_dict['POOL'].get('WARMUP', 0),
+                lambda: super(DatabaseWrapper, self).get_new_connection(conn_params)
+            )
+        elif self.settings_dict['CONN_MAX_AGE'] != 0:
+            self.ensure_connection()
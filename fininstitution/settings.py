@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'accounts.middleware.MetricsMiddleware',
+    'accounts.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,9 +87,32 @@ DATABASES = {
         'HOST': os.environ.get('SQL_HOST', 'localhost'),
         'PORT': os.environ.get('SQL_PORT', '5432'),
         'ATOMIC_REQUESTS': True,
+        # Seconds a connection is reused by later requests, 0 opens one for every request
+        'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE', 0)),
+        # Options below are supported by the fininstitution.db.postgresql engine
+        'CONN_HEALTH_CHECKS': bool(int(os.environ.get('CONN_HEALTH_CHECKS', 1))),
+        'POOL': {
+            'SIZE': int(os.environ.get('DB_POOL_SIZE', 0)),
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            'WARMUP': int(os.environ.get('DB_POOL_WARMUP', 0)),
+        },
     }
 }
 
+# Read replicas of the primary database, space separated hosts. Safe requests read from them
+# until they write anything, see accounts.routers
+for index, host in enumerate(filter(None, os.environ.get('SQL_REPLICA_HOSTS', '').split(' ')), start=1):
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'ATOMIC_REQUESTS': False,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+DATABASE_ROUTERS = ['accounts.routers.ReplicaRouter']
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -131,25 +156,88 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.BasicAuthentication',
+        'accounts.authentication.CachedBasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAdminUser',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
-    'PAGE_SIZE': 50
+    'DEFAULT_RENDERER_CLASSES': (
+        'accounts.renderers.ORJSONRenderer',
+        'accounts.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'accounts.parsers.ORJSONParser',
+        'accounts.parsers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'accounts.pagination.CountModePagination',
+    'PAGE_SIZE': 50,
+    # Token buckets per user and throttle scope of the view, kept in the shared cache (see accounts.throttling).
+    # An empty rate disables the limit of the scope.
+    'DEFAULT_THROTTLE_CLASSES': (
+        'accounts.throttling.TokenBucketThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'transfers': os.environ.get('TRANSFER_THROTTLE_RATE', '600/min'),
+        'lists': os.environ.get('LIST_THROTTLE_RATE', '600/min'),
+    },
+    # Transfers in progress at once across all workers, more are rejected with 503. 0 disables the cap.
+    'TRANSFER_CONCURRENCY_LIMIT': int(os.environ.get('TRANSFER_CONCURRENCY_LIMIT', 32)),
+}
+
+# Shared between all workers in production (e.g. memcached), see .env.prod
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# How long tokens of users with changed password or access flags stay rejected, 0 disables the check.
+# Should cover the refresh token lifetime, as refreshed access tokens keep the original issue time.
+JWT_REVOCATION_TTL = int(os.environ.get('JWT_REVOCATION_TTL', 24 * 60 * 60))
+
+# How long verified basic authentication credentials are remembered, 0 disables it
+BASIC_AUTH_CACHE_TTL = int(os.environ.get('BASIC_AUTH_CACHE_TTL', 60))
+
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 60 * 60))
+
+HISTORY_EXPORT_CHUNK_SIZE = int(os.environ.get('HISTORY_EXPORT_CHUNK_SIZE', 2000))
+
+# Months of balance history kept in the hot table besides the current one, older months are moved
+# to the archive table by the `archive_history` command
+HISTORY_HOT_MONTHS = int(os.environ.get('HISTORY_HOT_MONTHS', 12))
+
+# Queue every transfer for the `process_transfers` worker instead of applying it within the request
+ASYNC_TRANSFERS = int(os.environ.get('ASYNC_TRANSFERS', 0))
+
+# How long responses of transfers made with an Idempotency-Key header are kept for replay
+# (older keys are deleted by the `expire_idempotency_keys` command)
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+BATCH_TRANSFER_MAX_SIZE = int(os.environ.get('BATCH_TRANSFER_MAX_SIZE', 5000))
+
+BULK_CREATE_MAX_SIZE = int(os.environ.get('BULK_CREATE_MAX_SIZE', 1000))
+
+# Total reported by list pages of each view: exact, none (no COUNT query), estimate (PostgreSQL planner
+# statistics) or cached (exact count refreshed in the background), see accounts.pagination
+PAGINATION_COUNT_MODES = {
+    'BankAccountViewSet': os.environ.get('BANK_ACCOUNT_LIST_COUNT_MODE', 'exact'),
+    'UserViewSet': os.environ.get('USER_LIST_COUNT_MODE', 'exact'),
 }
 
-CACHE_TTL = 60 * 60
+PAGINATION_COUNT_CACHE_TTL = int(os.environ.get('PAGINATION_COUNT_CACHE_TTL', 60))
 
 sentry_sdk.init(
     dsn=os.environ.get('SENTRY_DSN'),
     integrations=[DjangoIntegration()],
 
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for performance monitoring.
-    traces_sample_rate=1.0,
+    # Share of transactions traced for performance monitoring (1.0 captures 100%).
+    # Hot path latencies are also available from the /metrics endpoint.
+    traces_sample_rate=float(os.environ.get('SENTRY_TRACES_SAMPLE_RATE', 1.0)),
     send_default_pii=True
 )
@@ -0,0 +1,11 @@
+"""Settings used by `manage.py test`: the regular settings and a stand-in read replica"""
+from fininstitution.settings import *  # noqa: F401,F403
+from fininstitution.settings import DATABASES
+
+# A second, separate SQLite database stands in for a read replica. It is only created for tests
+# listing it in `databases`, and reads are only routed to it by tests overriding DATABASE_REPLICAS.
+DATABASES['replica'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': 'replica.sqlite3',
+    'TEST': {'NAME': None},
+}
@@ -9,6 +9,9 @@ from rest_framework_simplejwt.views import (
     TokenVerifyView
 )
 
+from accounts.authentication import ClaimsTokenObtainPairSerializer, RevocationCheckedTokenRefreshSerializer
+from accounts.views import metrics_view
+
 urlpatterns = [
     path('openapi/', get_schema_view(
         title="Financial Institution API",
@@ -22,8 +25,11 @@ urlpatterns = [
         extra_context={'schema_url': 'openapi-schema'}
     ), name='swagger-ui'),
     path('admin/', admin.site.urls),
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('metrics', metrics_view, name='metrics'),
+    path('api/token/', TokenObtainPairView.as_view(serializer_class=ClaimsTokenObtainPairSerializer),
+         name='token_obtain_pair'),
+    path('api/token/refresh/', TokenRefreshView.as_view(serializer_class=RevocationCheckedTokenRefreshSerializer),
+         name='token_refresh'),
     path('api/token/verify/', TokenVerifyView.as_view(), name='token_verify'),
     path('api/', include('accounts.urls')),
 ]
@@ -11,6 +11,10 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from fininstitution.db.pool import warm_up_connections
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fininstitution.settings')
 
 application = get_wsgi_application()
+
+warm_up_connections()